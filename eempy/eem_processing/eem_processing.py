@@ -7,26 +7,27 @@ from matplotlib import pyplot as plt
 
 from eempy.utils import *
 import scipy.stats as stats
-import random
 import pandas as pd
 import numpy as np
 import itertools
 import string
 import warnings
 import json
-from math import sqrt
-from sklearn.metrics import mean_squared_error, explained_variance_score, r2_score
+from functools import lru_cache
+from joblib import Parallel, delayed
 # from sklearn.ensemble import IsolationForest
 # from sklearn import svm
 from sklearn.decomposition import PCA, NMF
 from sklearn.linear_model import LinearRegression
 from scipy.ndimage import gaussian_filter, median_filter
 from scipy.interpolate import RegularGridInterpolator, interp1d, griddata
+from scipy.spatial import Delaunay
 from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.optimize import linear_sum_assignment
 from scipy.spatial.distance import squareform
 from scipy.sparse.linalg import ArpackError
 from tensorly.decomposition import parafac, non_negative_parafac
-from tensorly.cp_tensor import cp_to_tensor
+from tensorly.cp_tensor import cp_to_tensor, CPTensor
 from tlviz.model_evaluation import core_consistency
 from tlviz.outliers import compute_leverage
 from tlviz.factor_tools import permute_cp_tensor
@@ -58,6 +59,12 @@ def process_eem_stack(eem_stack, f, **kwargs):
         If the EEM processing function have more than 1 returns, the rest of the returns will be stored in a tuple,
         where each element is the return of EEM processing function applied to every EEM.
     """
+    # ------Functions that can process the whole stack in one vectorized call------
+    if f in _STACK_IMPLEMENTATIONS:
+        stack_output = _STACK_IMPLEMENTATIONS[f](eem_stack, **kwargs)
+        if stack_output is not None:
+            return stack_output
+
     processed_eem_stack = []
     other_outputs = []
 
@@ -117,13 +124,15 @@ def eem_threshold_masking(intensity, threshold, fill=np.nan, mask_type='greater'
     mask: np.ndarray
         The mask matrix. +1: unmasked area; np.nan: masked area.
     """
-    mask = np.ones(intensity.shape)
-    intensity_masked = intensity.astype(float)
     if mask_type == 'smaller':
-        mask[np.where(intensity < threshold)] = np.nan
-    if mask_type == 'greater':
-        mask[np.where(intensity > threshold)] = np.nan
-    intensity_masked[np.isnan(mask)] = fill
+        masked = intensity < threshold
+    elif mask_type == 'greater':
+        masked = intensity > threshold
+    else:
+        masked = np.zeros(intensity.shape, dtype=bool)
+    # integer EEMs are converted to float, float32 EEMs stay in float32
+    intensity_masked = np.where(masked, fill, intensity).astype(np.result_type(intensity, np.float32), copy=False)
+    mask = np.where(masked, np.nan, 1.)
     return intensity_masked, mask
 
 
@@ -280,14 +289,40 @@ def eem_nan_imputing(intensity, ex_range, em_range, method: str = 'linear', fill
     intensity_imputed: np.ndarray
         The imputed EEM.
     """
-    x, y = np.meshgrid(em_range, ex_range[::-1])
-    xx = x[~np.isnan(intensity)].flatten()
-    yy = y[~np.isnan(intensity)].flatten()
-    zz = intensity[~np.isnan(intensity)].flatten()
-    if isinstance(fill_value, float):
-        intensity_imputed = griddata((xx, yy), zz, (x, y), method=method, fill_value=fill_value)
-    elif fill_value == 'linear_ex':
-        intensity_imputed = griddata((xx, yy), zz, (x, y), method=method)
+    nan_loc = np.isnan(intensity)
+    nan_rows, nan_cols = nan_loc.all(axis=1), nan_loc.all(axis=0)
+    fill = fill_value if isinstance(fill_value, float) else np.nan
+    if method == 'linear' and np.array_equal(nan_loc, np.broadcast_to(nan_rows[:, None], nan_loc.shape)) \
+            and np.count_nonzero(~nan_rows) > 1:
+        # NaN only appear as entire rows (e.g. no NaN at all): the linear interpolation on the regular grid reduces
+        # to a 1d interpolation along excitation, so the Delaunay triangulation of griddata() can be skipped.
+        intensity_imputed = intensity.astype(float)
+        f = interp1d(ex_range[::-1][~nan_rows], intensity[~nan_rows], axis=0, bounds_error=False, fill_value=fill)
+        intensity_imputed[nan_rows] = f(ex_range[::-1][nan_rows])
+    elif method == 'linear' and np.array_equal(nan_loc, np.broadcast_to(nan_cols, nan_loc.shape)) \
+            and np.count_nonzero(~nan_cols) > 1:
+        # The same as above for NaN appearing as entire columns.
+        intensity_imputed = intensity.astype(float)
+        f = interp1d(em_range[~nan_cols], intensity[:, ~nan_cols], axis=1, bounds_error=False, fill_value=fill)
+        intensity_imputed[:, nan_cols] = f(em_range[nan_cols])
+    elif method == 'linear':
+        # The Delaunay triangulation and the barycentric weights of the grid points only depend on the grid and the
+        # NaN pattern, which are usually shared by all EEMs of a stack (e.g. identical scattering masks). They are
+        # therefore cached, and the interpolation of each EEM reduces to a weighted sum.
+        vertices, weights, inside = _grid_barycentric_weights(np.asarray(ex_range, dtype=float).tobytes(),
+                                                              np.asarray(em_range, dtype=float).tobytes(),
+                                                              np.packbits(nan_loc).tobytes())
+        zz = intensity[~nan_loc].flatten()
+        intensity_imputed = np.full(intensity.size, fill, dtype=float)
+        intensity_imputed[inside] = np.einsum('ij,ij->i', zz[vertices], weights)
+        intensity_imputed = intensity_imputed.reshape(intensity.shape)
+    else:
+        x, y = np.meshgrid(em_range, ex_range[::-1])
+        xx = x[~nan_loc].flatten()
+        yy = y[~nan_loc].flatten()
+        zz = intensity[~nan_loc].flatten()
+        intensity_imputed = griddata((xx, yy), zz, (x, y), method=method, fill_value=fill)
+    if fill_value == 'linear_ex':
         for i in range(intensity_imputed.shape[1]):
             col = intensity_imputed[:, i]
             mask = np.isnan(col)
@@ -297,7 +332,6 @@ def eem_nan_imputing(intensity, ex_range, em_range, method: str = 'linear', fill
                 col[mask] = interp_func(np.flatnonzero(mask))
             intensity_imputed[:, i] = col
     elif fill_value == 'linear_em':
-        intensity_imputed = griddata((xx, yy), zz, (x, y), method=method)
         for j in range(intensity_imputed.shape[0]):
             col = intensity_imputed[j, :]
             mask = np.isnan(col)
@@ -306,7 +340,24 @@ def eem_nan_imputing(intensity, ex_range, em_range, method: str = 'linear', fill
                                        fill_value='extrapolate')
                 col[mask] = interp_func(np.flatnonzero(mask))
             intensity_imputed[j, :] = col
-    return intensity_imputed
+    return intensity_imputed.astype(np.result_type(intensity, np.float32), copy=False)
+
+
+@lru_cache(maxsize=16)
+def _grid_barycentric_weights(ex_range_bytes, em_range_bytes, nan_loc_bytes):
+    ex_range = np.frombuffer(ex_range_bytes)
+    em_range = np.frombuffer(em_range_bytes)
+    nan_loc = np.unpackbits(np.frombuffer(nan_loc_bytes, dtype=np.uint8),
+                            count=ex_range.shape[0] * em_range.shape[0]).reshape(-1, em_range.shape[0]).astype(bool)
+    x, y = np.meshgrid(em_range, ex_range[::-1])
+    tri = Delaunay(np.column_stack([x[~nan_loc], y[~nan_loc]]))
+    xi = np.column_stack([x.ravel(), y.ravel()])
+    simplex = tri.find_simplex(xi)
+    inside = simplex >= 0
+    transform = tri.transform[simplex[inside]]
+    b = np.einsum('ijk,ik->ij', transform[:, :2], xi[inside] - transform[:, 2])
+    weights = np.column_stack([b, 1 - b.sum(axis=1)])
+    return tri.simplices[simplex[inside]], weights, inside
 
 
 def eem_raman_normalization(intensity, blank=None, ex_range_blank=None, em_range_blank=None, from_blank=True,
@@ -351,10 +402,7 @@ def eem_raman_normalization(intensity, blank=None, ex_range_blank=None, em_range
     if not from_blank:
         return intensity / manual_rsu, manual_rsu
     else:
-        em_target = -ex_target / (0.00036 * ex_target - 1)
-        rsu, _ = eem_regional_integration(blank, ex_range_blank, em_range_blank,
-                                          ex_min=ex_target, ex_max=ex_target, em_min=em_target - bandwidth / 2,
-                                          em_max=em_target + bandwidth / 2)
+        rsu = _raman_scattering_unit(blank, ex_range_blank, em_range_blank, ex_target, bandwidth)
         # elif bandwidth_type == 'wavenumber':
         #     em_target = -ex / (0.00036 * ex - 1)
         #     wn_target = 10000000 / em_target
@@ -367,6 +415,151 @@ def eem_raman_normalization(intensity, blank=None, ex_range_blank=None, em_range
     return intensity_normalized, rsu_final
 
 
+def _raman_scattering_unit(blank, ex_range_blank, em_range_blank, ex_target, bandwidth):
+    """
+    Integrate the Raman peak of a blank (or a stack of blanks, along the last two axes) over the emission band
+    centered at the Raman emission of ex_target. This is equivalent to eem_regional_integration() over a single
+    excitation wavelength, but only the Raman line is interpolated.
+    """
+    em_target = -ex_target / (0.00036 * ex_target - 1)
+    em_min, em_max = em_target - bandwidth / 2, em_target + bandwidth / 2
+    em_range_band = np.unique(np.concatenate([[em_min, em_max],
+                                              em_range_blank[(em_range_blank > em_min) & (em_range_blank < em_max)]]))
+    ex_idx, ex_w = _linear_weights(ex_range_blank, np.array([ex_target]))
+    em_idx, em_w = _linear_weights(em_range_blank, em_range_band)
+    # rows of the blank are flipped to ascending excitation wavelengths
+    z = blank[..., ::-1, :]
+    raman_row = (1 - ex_w[0]) * z[..., ex_idx[0], :] + ex_w[0] * z[..., ex_idx[0] + 1, :]
+    raman_line = (1 - em_w) * raman_row[..., em_idx] + em_w * raman_row[..., em_idx + 1]
+    return np.trapz(raman_line, em_range_band, axis=-1)
+
+
+def _scattering_mask(ex_range, em_range, lambda_em, width, include_em_end=False):
+    """
+    Build the mask of a scattering band centered at the emission wavelengths lambda_em.
+
+    Parameters
+    ----------
+    ex_range: np.ndarray (1d)
+        The excitation wavelengths.
+    em_range: np.ndarray (1d)
+        The emission wavelengths.
+    lambda_em: np.ndarray (1d)
+        The emission wavelength of the scattering at each excitation wavelength.
+    width: float
+        The half-width of the scattering band.
+    include_em_end: bool
+        Whether a band starting exactly at the last emission wavelength is still masked.
+
+    Returns
+    -------
+    mask: np.ndarray
+        The mask matrix. 0: pixel in the scattering band; 1: pixel outside the scattering band.
+    below: np.ndarray
+        Boolean matrix marking the pixels at emission wavelengths shorter than a scattering band lying entirely within
+        the emission range.
+    """
+    # The masks only depend on the wavelengths, so they are cached across the EEMs (and the calls) that share them.
+    # The cached arrays are read-only.
+    return _scattering_mask_cached(np.asarray(em_range, dtype=float).tobytes(),
+                                   np.asarray(lambda_em, dtype=float).tobytes(), float(width), include_em_end)
+
+
+@lru_cache(maxsize=32)
+def _scattering_mask_cached(em_range_bytes, lambda_em_bytes, width, include_em_end):
+    em_range = np.frombuffer(em_range_bytes)
+    lambda_em = np.frombuffer(lambda_em_bytes)
+    n_em = em_range.shape[0]
+    tol_emidx = int(np.round(width / (em_range[1] - em_range[0])))
+    upper = lambda_em + width
+    lower = lambda_em - width
+    # the three ways a scattering band can overlap the emission range, evaluated for all excitations at once
+    band_start_outside = (lambda_em <= em_range[0]) & (em_range[0] <= upper)
+    center_outside = ~band_start_outside & (lower <= em_range[0]) & (em_range[0] < lambda_em)
+    inside = ~band_start_outside & ~center_outside & (em_range[0] < lower) & (
+        (lower <= em_range[-1]) if include_em_end else (lower < em_range[-1]))
+    lower_idx = dichotomy_search(em_range, lower)
+    start = np.where(inside, lower_idx, 0)
+    stop = np.select([band_start_outside, center_outside, inside],
+                     [dichotomy_search(em_range, upper) + 1,
+                      dichotomy_search(em_range, lambda_em) + tol_emidx + 1,
+                      np.minimum(n_em, lower_idx + 2 * tol_emidx + 1)],
+                     default=0)
+    # rows of the EEM are sorted by descending excitation wavelengths
+    cols = np.arange(n_em)
+    start, stop, inside = start[::-1, None], stop[::-1, None], inside[::-1, None]
+    mask = np.where((cols >= start) & (cols < stop), 0., 1.)
+    below = inside & (cols < start)
+    mask.flags.writeable = False
+    below.flags.writeable = False
+    return mask, below
+
+
+def _interpolate_masked_1d(intensity, mask, x, kind, axis):
+    """
+    Replace, in place, the values of an EEM along each row (axis=1) or column (axis=0) by the 1d interpolation (and
+    extrapolation) of the pixels where mask == 1. Rows/columns on which interp1d fails are left unchanged.
+
+    With kind='linear', the pixels where mask == 1 keep their values, and a nan value only propagates to the masked
+    pixels interpolated from it. This differs from evaluating interp1d on the whole line, which also turns the valid
+    pixels next to a nan value into nan.
+
+    Parameters
+    ----------
+    intensity: np.ndarray (2d) or np.ndarray (3d)
+        The EEM, or an EEM stack whose EEMs share the same mask.
+    mask: np.ndarray (2d)
+        The mask matrix. 0: pixel to interpolate; 1: pixel used for interpolation.
+    x: np.ndarray (1d)
+        The wavelengths along the interpolation axis, monotonic.
+    kind: str
+        The kind of interpolation, see scipy.interpolate.interp1d.
+    axis: int
+        The axis of the EEM along which to interpolate, 0 for excitation and 1 for emission.
+    """
+    # Work on lines stored as rows. The axis is counted from the end so that the leading axes of an EEM stack are
+    # broadcast, all EEMs sharing the same mask.
+    eem_lines = np.moveaxis(intensity, axis - 2, -1)
+    n = eem_lines.shape[-1]
+    data = eem_lines.reshape(-1, n)
+    valid = np.broadcast_to(np.moveaxis(mask == 1, axis - 2, -1), eem_lines.shape).reshape(-1, n)
+    n_valid = np.count_nonzero(valid, axis=1)
+    interpolable = n_valid >= 2
+    if kind == 'linear':
+        # For linear interpolation, every pixel only depends on the nearest valid neighbours on both sides (or the
+        # two closest valid pixels on one side for extrapolation), which are found for all lines at once.
+        valid, y = valid[interpolable], data[interpolable].astype(float)
+        idx = np.arange(n)
+        prev = np.maximum.accumulate(np.where(valid, idx, -1), axis=1)
+        nxt = np.minimum.accumulate(np.where(valid, idx, n)[:, ::-1], axis=1)[:, ::-1]
+        rows = np.arange(valid.shape[0])[:, np.newaxis]
+        first, last = nxt[:, [0]], prev[:, [-1]]
+        second, second_last = nxt[rows, first + 1], prev[rows, last - 1]
+        lo = np.where(prev < 0, first, np.where(nxt >= n, second_last, prev))
+        hi = np.where(prev < 0, second, np.where(nxt >= n, last, nxt))
+        y_lo, y_hi = y[rows, lo], y[rows, hi]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            y_interp = y_lo + (y_hi - y_lo) * (x - x[lo]) / (x[hi] - x[lo])
+        data[interpolable] = np.where(valid, y, y_interp)
+        # as with interp1d, a single valid pixel gives no defined slope
+        data[n_valid == 1] = np.nan
+    else:
+        # lines sharing the same mask pattern are interpolated with a single interp1d
+        patterns, inverse = np.unique(valid, axis=0, return_inverse=True)
+        for k, pattern in enumerate(patterns):
+            lines = (inverse.ravel() == k) & interpolable
+            if not lines.any():
+                continue
+            try:
+                f1 = interp1d(x[pattern], data[lines][:, pattern], kind=kind, axis=1, fill_value='extrapolate')
+                data[lines] = f1(x)
+            except ValueError:
+                continue
+    # write back in case reshaping the lines required a copy
+    if not np.shares_memory(data, intensity):
+        eem_lines[...] = data.reshape(eem_lines.shape)
+
+
 def eem_raman_scattering_removal(intensity, ex_range, em_range, width=5, interpolation_method='linear',
                                  interpolation_dimension='2d'):
     """
@@ -398,53 +591,25 @@ def eem_raman_scattering_removal(intensity, ex_range, em_range, width=5, interpo
     """
     intensity_masked = np.array(intensity)
     width = width / 2
-    raman_mask = np.ones(intensity.shape)
     lambda_em = -ex_range / (0.00036 * ex_range - 1)
-    tol_emidx = int(np.round(width / (em_range[1] - em_range[0])))
-    for s in range(0, intensity_masked.shape[0]):
-        exidx = ex_range.shape[0] - s - 1
-        if lambda_em[s] <= em_range[0] <= lambda_em[s] + width:
-            emidx = dichotomy_search(em_range, lambda_em[s] + width)
-            raman_mask[exidx, 0: emidx + 1] = 0
-        elif lambda_em[s] - width <= em_range[0] < lambda_em[s]:
-            emidx = dichotomy_search(em_range, lambda_em[s])
-            raman_mask[exidx, 0: emidx + tol_emidx + 1] = 0
-        elif em_range[0] < lambda_em[s] - width < em_range[-1]:
-            emidx = dichotomy_search(em_range, lambda_em[s] - width)
-            raman_mask[exidx, emidx: min(em_range.shape[0], emidx + 2 * tol_emidx + 1)] = 0
+    raman_mask, _ = _scattering_mask(ex_range, em_range, lambda_em, width)
 
     if interpolation_method == 'nan':
-        intensity_masked[np.where(raman_mask == 0)] = np.nan
+        intensity_masked[..., raman_mask == 0] = np.nan
     else:
         if interpolation_dimension == '1d-ex':
-            for j in range(0, intensity.shape[1]):
-                try:
-                    x = np.flipud(ex_range)[np.where(raman_mask[:, j] == 1)]
-                    y = intensity_masked[:, j][np.where(raman_mask[:, j] == 1)]
-                    f1 = interp1d(x, y, kind=interpolation_method, fill_value='extrapolate')
-                    y_predict = f1(np.flipud(ex_range))
-                    intensity_masked[:, j] = y_predict
-                except ValueError:
-                    continue
+            _interpolate_masked_1d(intensity_masked, raman_mask, np.flipud(ex_range), interpolation_method, axis=0)
 
         if interpolation_dimension == '1d-em':
-            for i in range(0, intensity.shape[0]):
-                try:
-                    x = em_range[np.where(raman_mask[i, :] == 1)]
-                    y = intensity_masked[i, :][np.where(raman_mask[i, :] == 1)]
-                    f1 = interp1d(x, y, kind=interpolation_method, fill_value='extrapolate')
-                    y_predict = f1(em_range)
-                    intensity_masked[i, :] = y_predict
-                except ValueError:
-                    continue
+            _interpolate_masked_1d(intensity_masked, raman_mask, em_range, interpolation_method, axis=1)
 
         if interpolation_dimension == '2d':
             old_nan = np.isnan(intensity)
-            intensity_masked[np.where(raman_mask == 0)] = np.nan
+            intensity_masked[..., raman_mask == 0] = np.nan
             intensity_masked = eem_nan_imputing(intensity_masked, ex_range, em_range, method=interpolation_method)
             # restore the nan values in non-raman-scattering region
             intensity_masked[old_nan] = np.nan
-    return intensity_masked, raman_mask
+    return intensity_masked, raman_mask.copy()
 
 
 def eem_rayleigh_scattering_removal(intensity, ex_range, em_range, width_o1=15, width_o2=15,
@@ -489,80 +654,38 @@ def eem_rayleigh_scattering_removal(intensity, ex_range, em_range, width_o1=15,
         0: pixel is interpolated; 1: pixel is not interpolated.
     """
     intensity_masked = np.array(intensity)
-    rayleigh_mask_o1 = np.ones(intensity.shape)
-    rayleigh_mask_o2 = np.ones(intensity.shape)
     # convert the entire width to half-width
     width_o1 = width_o1 / 2
     width_o2 = width_o2 / 2
-    lambda_em_o1 = ex_range
-    tol_emidx_o1 = int(np.round(width_o1 / (em_range[1] - em_range[0])))
-    for s in range(0, intensity_masked.shape[0]):
-        exidx = ex_range.shape[0] - s - 1
-        if lambda_em_o1[s] <= em_range[0] <= lambda_em_o1[s] + width_o1:
-            emidx = dichotomy_search(em_range, lambda_em_o1[s] + width_o1)
-            rayleigh_mask_o1[exidx, 0:emidx + 1] = 0
-        elif lambda_em_o1[s] - width_o1 <= em_range[0] < lambda_em_o1[s]:
-            emidx = dichotomy_search(em_range, lambda_em_o1[s])
-            rayleigh_mask_o1[exidx, 0: emidx + tol_emidx_o1 + 1] = 0
-        elif em_range[0] < lambda_em_o1[s] - width_o1 < em_range[-1]:
-            emidx = dichotomy_search(em_range, lambda_em_o1[s] - width_o1)
-            rayleigh_mask_o1[exidx, emidx: min(em_range.shape[0], emidx + 2 * tol_emidx_o1 + 1)] = 0
-            intensity_masked[exidx, 0: emidx] = 0
-
-    lambda_em_o2 = ex_range * 2
-    tol_emidx_o2 = int(np.round(width_o2 / (em_range[1] - em_range[0])))
-    for s in range(0, intensity_masked.shape[0]):
-        exidx = ex_range.shape[0] - s - 1
-        if lambda_em_o2[s] <= em_range[0] <= lambda_em_o2[s] + width_o2:
-            emidx = dichotomy_search(em_range, lambda_em_o2[s] + width_o2)
-            rayleigh_mask_o2[exidx, 0:emidx + 1] = 0
-        elif lambda_em_o2[s] - width_o2 <= em_range[0] < lambda_em_o2[s]:
-            emidx = dichotomy_search(em_range, lambda_em_o2[s])
-            rayleigh_mask_o2[exidx, 0: emidx + tol_emidx_o2 + 1] = 0
-        elif em_range[0] < lambda_em_o2[s] - width_o2 <= em_range[-1]:
-            emidx = dichotomy_search(em_range, lambda_em_o2[s] - width_o2)
-            rayleigh_mask_o2[exidx, emidx: min(em_range.shape[0], emidx + 2 * tol_emidx_o2 + 1)] = 0
+    rayleigh_mask_o1, below_o1 = _scattering_mask(ex_range, em_range, ex_range, width_o1)
+    # the emission below the 1st order Rayleigh scattering is physically zero
+    intensity_masked[..., below_o1] = 0
+    rayleigh_mask_o2, _ = _scattering_mask(ex_range, em_range, ex_range * 2, width_o2, include_em_end=True)
 
     for axis, itp, mask in zip([interpolation_dimension_o1, interpolation_dimension_o2],
                                [interpolation_method_o1, interpolation_method_o2],
                                [rayleigh_mask_o1, rayleigh_mask_o2]):
         if itp == 'zero':
-            intensity_masked[np.where(mask == 0)] = 0
+            intensity_masked[..., mask == 0] = 0
         elif itp == 'nan':
-            intensity_masked[np.where(mask == 0)] = np.nan
+            intensity_masked[..., mask == 0] = np.nan
         elif itp == 'none':
             pass
         else:
             if axis == '1d-ex':
-                for j in range(0, intensity.shape[1]):
-                    try:
-                        x = np.flipud(ex_range)[np.where(mask[:, j] == 1)]
-                        y = intensity_masked[:, j][np.where(mask[:, j] == 1)]
-                        f1 = interp1d(x, y, kind=itp, fill_value='extrapolate')
-                        y_predict = f1(np.flipud(ex_range))
-                        intensity_masked[:, j] = y_predict
-                    except ValueError:
-                        continue
+                _interpolate_masked_1d(intensity_masked, mask, np.flipud(ex_range), itp, axis=0)
             if axis == '1d-em':
-                for i in range(0, intensity.shape[0]):
-                    try:
-                        x = em_range[np.where(mask[i, :] == 1)]
-                        y = intensity_masked[i, :][np.where(mask[i, :] == 1)]
-                        f1 = interp1d(x, y, kind=itp, fill_value='extrapolate')
-                        y_predict = f1(em_range)
-                        intensity_masked[i, :] = y_predict
-                    except ValueError:
-                        continue
+                _interpolate_masked_1d(intensity_masked, mask, em_range, itp, axis=1)
             if axis == '2d':
                 old_nan = np.isnan(intensity)
                 old_nan_o1 = np.isnan(intensity_masked)
-                intensity_masked[np.where(mask == 0)] = np.nan
+                intensity_masked[..., mask == 0] = np.nan
                 intensity_masked = eem_nan_imputing(intensity_masked, ex_range, em_range, method=itp,
                                                     fill_value='linear_ex')
                 # restore the nan values in non-raman-scattering region
                 intensity_masked[old_nan] = np.nan
                 intensity_masked[old_nan_o1] = np.nan
-    return intensity_masked, rayleigh_mask_o1, rayleigh_mask_o2
+    return intensity_masked, rayleigh_mask_o1.copy(), rayleigh_mask_o2.copy()
 
 
 def eem_ife_correction(intensity, ex_range_eem, em_range_eem, absorbance, ex_range_abs):
@@ -591,12 +714,20 @@ def eem_ife_correction(intensity, ex_range_eem, em_range_eem, absorbance, ex_ran
     """
     # if absorbance.ndim == 1:
     #     absorbance_reshape = absorbance.reshape((1, absorbance.shape[0]))
-    f1 = interp1d(ex_range_abs, absorbance, kind='linear', bounds_error=False, fill_value='extrapolate')
-    absorbance_ex = np.fliplr(np.array([f1(ex_range_eem)]))
-    absorbance_em = np.array([f1(em_range_eem)])
-    ife_factors = 10 ** ((absorbance_ex.T.dot(np.ones(absorbance_em.shape)) +
-                          np.ones(absorbance_ex.shape).T.dot(absorbance_em)) / 2)
-    intensity_corrected = intensity * ife_factors
+    # Linear interpolation (and extrapolation) of the absorbance with precomputed neighbours and weights, which also
+    # applies to the leading axes of the absorbance (one spectrum per sample of an EEM stack).
+    order = np.argsort(ex_range_abs)
+    ex_range_abs, absorbance = ex_range_abs[order], absorbance[..., order]
+    idx, w = _linear_weights(ex_range_abs, np.concatenate([ex_range_eem[::-1], em_range_eem]), extrapolate=True)
+    absorbance_lo, absorbance_hi = absorbance[..., idx], absorbance[..., idx + 1]
+    # wavelengths on a node of ex_range_abs only take the absorbance of that node, so that a nan absorbance does not
+    # spread to its measured neighbours through a zero weight (0 * nan is nan)
+    absorbance_interpolated = np.where(w == 0, absorbance_lo,
+                                       np.where(w == 1, absorbance_hi, (1 - w) * absorbance_lo + w * absorbance_hi))
+    # 10^((A_ex + A_em) / 2) = 10^(A_ex / 2) * 10^(A_em / 2): the exponentials are only evaluated on the 1d spectra.
+    factors = np.power(10, absorbance_interpolated / 2)
+    factor_ex, factor_em = factors[..., :ex_range_eem.shape[0]], factors[..., ex_range_eem.shape[0]:]
+    intensity_corrected = intensity * factor_ex[..., :, np.newaxis] * factor_em[..., np.newaxis, :]
     return intensity_corrected
 
 
@@ -629,27 +760,36 @@ def eem_regional_integration(intensity, ex_range, em_range, ex_min, ex_max, em_m
         The average fluorescence intensity in the region.
     """
 
-    ex_range_interpolated = np.sort(np.unique(np.concatenate([ex_range, [ex_min, ex_max]])))
-    em_range_interpolated = np.sort(np.unique(np.concatenate([em_range, [em_min, em_max]])))
-    intensity_interpolated = eem_interpolation(intensity, ex_range, em_range, ex_range_interpolated,
-                                               em_range_interpolated, method='linear')
-    intensity_cut, ex_range_cut, em_range_cut = eem_cutting(intensity_interpolated, ex_range_interpolated,
-                                                            em_range_interpolated,
-                                                            ex_min_new=ex_min, ex_max_new=ex_max,
-                                                            em_min_new=ex_min, em_max_new=em_max)
-    if intensity_cut.shape[0] == 1:
-        integration = np.trapz(intensity_cut, em_range_cut, axis=1)
-    elif intensity_cut.shape[1] == 1:
-        integration = np.trapz(intensity_cut, ex_range_cut, axis=0)
-    else:
-        result_x = np.trapz(intensity_cut, np.flip(ex_range_cut), axis=0)
-        integration = np.absolute(np.trapz(result_x, em_range_cut, axis=0))
+    # Only the grid points inside the region (plus its boundaries) are interpolated, instead of interpolating the
+    # whole EEM and cutting it afterwards.
+    ex_range_cut = np.unique(np.concatenate([[ex_min, ex_max], ex_range[(ex_range > ex_min) & (ex_range < ex_max)]]))
+    em_range_cut = np.unique(np.concatenate([[em_min, em_max], em_range[(em_range > em_min) & (em_range < em_max)]]))
+    intensity_cut = eem_interpolation(intensity, ex_range, em_range, ex_range_cut, em_range_cut, method='linear')
+    # The trapezoidal rule along both axes is applied in one pass with separable weights (rows of the EEM are in
+    # descending excitation wavelengths). Leading axes (e.g. the sample axis of an EEM stack) are broadcast.
+    integration = np.einsum('...ij,i,j->...', intensity_cut, _trapezoid_weights(ex_range_cut)[::-1],
+                            _trapezoid_weights(em_range_cut))
+    if ex_range_cut.shape[0] > 1 and em_range_cut.shape[0] > 1:
+        integration = np.absolute(integration)
     # number of effective pixels (i.e. pixels with positive intensity)
-    num_pixels = intensity[intensity > 0].shape[0]
+    num_pixels = np.count_nonzero(intensity > 0, axis=(-2, -1))
     avg_regional_intensity = integration / num_pixels
     return integration, avg_regional_intensity
 
 
+def _trapezoid_weights(x):
+    """
+    Get the weights w such that np.dot(y, w) equals np.trapz(y, x). A single point is given a weight of 1.
+    """
+    if x.shape[0] == 1:
+        return np.ones(1)
+    dx = np.diff(x) / 2
+    w = np.zeros(x.shape[0])
+    w[:-1] += dx
+    w[1:] += dx
+    return w
+
+
 def eem_interpolation(intensity, ex_range_old, em_range_old, ex_range_new, em_range_new, method: str = 'linear'):
     """
     Interpolate EEM on given ex/em ranges. This function is typically used for changing the ex/em ranges of an EEM
@@ -676,12 +816,130 @@ def eem_interpolation(intensity, ex_range_old, em_range_old, ex_range_new, em_ra
     intensity_interpolated: np.ndarray
         The interpolated EEM.
     """
+    if method == 'linear' and ex_range_old.shape[0] > 1 and em_range_old.shape[0] > 1:
+        # The new ex/em ranges span a regular grid, so the bilinear weights are separable and only have to be
+        # computed once per axis. Rows of the EEM are flipped to ascending excitation wavelengths.
+        ex_idx, ex_w = _linear_weights(ex_range_old, ex_range_new)
+        em_idx, em_w = _linear_weights(em_range_old, em_range_new)
+        # Leading axes (e.g. the sample axis of an EEM stack) are broadcast.
+        ex_idx, ex_w = ex_idx[:, None], ex_w[:, None]
+        z = intensity[..., ::-1, :]
+        intensity_interpolated = ((1 - ex_w) * (1 - em_w) * z[..., ex_idx, em_idx] +
+                                  (1 - ex_w) * em_w * z[..., ex_idx, em_idx + 1] +
+                                  ex_w * (1 - em_w) * z[..., ex_idx + 1, em_idx] +
+                                  ex_w * em_w * z[..., ex_idx + 1, em_idx + 1])[..., ::-1, :]
+        return intensity_interpolated
     interp = RegularGridInterpolator((ex_range_old[::-1], em_range_old), intensity, method=method, bounds_error=False)
     x, y = np.meshgrid(ex_range_new[::-1], em_range_new, indexing='ij')
     intensity_interpolated = interp((x, y)).reshape(ex_range_new.shape[0], em_range_new.shape[0])
     return intensity_interpolated
 
 
+def _linear_weights(points, xi, extrapolate=False):
+    """
+    Get the index of the left neighbour in the ascending array points and the linear interpolation weight of the
+    right neighbour for each of xi. The weights of xi outside the range of points are nan, unless extrapolate is True,
+    in which case they extrapolate linearly from the first/last two points.
+    """
+    idx = np.clip(np.searchsorted(points, xi, side='right') - 1, 0, points.shape[0] - 2)
+    w = (xi - points[idx]) / (points[idx + 1] - points[idx])
+    if not extrapolate:
+        w[(xi < points[0]) | (xi > points[-1])] = np.nan
+    return idx, w
+
+
+def _stack_threshold_masking(eem_stack, **kwargs):
+    eem_stack_masked, masks = eem_threshold_masking(eem_stack, **kwargs)
+    return eem_stack_masked, [(mask,) for mask in masks]
+
+
+def _stack_gaussian_filter(eem_stack, sigma=1, truncate=3):
+    # a zero sigma along the sample axis keeps the EEMs independent of each other
+    sigma = (0,) + tuple(np.broadcast_to(sigma, (2,)))
+    return gaussian_filter(eem_stack, sigma=sigma, truncate=truncate)
+
+
+def _stack_median_filter(eem_stack, footprint=(3, 3), mode='reflect'):
+    return median_filter(eem_stack, footprint=np.ones((1,) + tuple(footprint)), mode=mode)
+
+
+def _stack_cutting(eem_stack, ex_range_old, em_range_old, ex_min_new, ex_max_new, em_min_new, em_max_new):
+    em_min_idx = dichotomy_search(em_range_old, em_min_new)
+    em_max_idx = dichotomy_search(em_range_old, em_max_new)
+    ex_min_idx = dichotomy_search(ex_range_old, ex_min_new)
+    ex_max_idx = dichotomy_search(ex_range_old, ex_max_new)
+    eem_stack_cut = eem_stack[:, ex_range_old.shape[0] - ex_max_idx - 1:ex_range_old.shape[0] - ex_min_idx,
+                              em_min_idx:em_max_idx + 1].copy()
+    em_range_cut = em_range_old[em_min_idx:em_max_idx + 1]
+    ex_range_cut = ex_range_old[ex_min_idx:ex_max_idx + 1]
+    return eem_stack_cut, [(ex_range_cut, em_range_cut)] * eem_stack.shape[0]
+
+
+def _stack_ife_correction(eem_stack, ex_range_eem, em_range_eem, absorbance, ex_range_abs):
+    return eem_ife_correction(eem_stack, ex_range_eem, em_range_eem, np.asarray(absorbance), ex_range_abs)
+
+
+def _stack_raman_normalization(eem_stack, blank=None, ex_range_blank=None, em_range_blank=None, from_blank=True,
+                               integration_time=1, ex_target=350, bandwidth=5, rsu_standard=20000, manual_rsu=1):
+    if not from_blank:
+        return eem_stack / manual_rsu, [(manual_rsu,)] * eem_stack.shape[0]
+    rsu = _raman_scattering_unit(np.asarray(blank), ex_range_blank, em_range_blank, ex_target, bandwidth)
+    rsu_final = np.broadcast_to(rsu / (integration_time * rsu_standard), (eem_stack.shape[0],))
+    return eem_stack / rsu_final[:, np.newaxis, np.newaxis], [(r,) for r in rsu_final]
+
+
+def _stack_interpolation(eem_stack, ex_range_old, em_range_old, ex_range_new, em_range_new, method='linear'):
+    if method == 'linear' and ex_range_old.shape[0] > 1 and em_range_old.shape[0] > 1:
+        return eem_interpolation(eem_stack, ex_range_old, em_range_old, ex_range_new, em_range_new, method=method)
+    # one interpolator for all EEMs, with the samples as trailing values dimension
+    interp = RegularGridInterpolator((ex_range_old[::-1], em_range_old), np.moveaxis(eem_stack, 0, -1), method=method,
+                                     bounds_error=False)
+    x, y = np.meshgrid(ex_range_new[::-1], em_range_new, indexing='ij')
+    return np.moveaxis(interp((x, y)), -1, 0)
+
+
+def _stack_raman_scattering_removal(eem_stack, ex_range, em_range, width=5, interpolation_method='linear',
+                                    interpolation_dimension='2d'):
+    # the 2d interpolation is done EEM by EEM
+    if interpolation_method != 'nan' and interpolation_dimension == '2d':
+        return None
+    eem_stack_masked, raman_mask = eem_raman_scattering_removal(eem_stack, ex_range, em_range, width=width,
+                                                                interpolation_method=interpolation_method,
+                                                                interpolation_dimension=interpolation_dimension)
+    return eem_stack_masked, [(raman_mask,)] * eem_stack.shape[0]
+
+
+def _stack_rayleigh_scattering_removal(eem_stack, ex_range, em_range, width_o1=15, width_o2=15,
+                                       interpolation_dimension_o1='2d', interpolation_dimension_o2='2d',
+                                       interpolation_method_o1='zero', interpolation_method_o2='linear'):
+    # the 2d interpolation is done EEM by EEM
+    for axis, itp in [(interpolation_dimension_o1, interpolation_method_o1),
+                      (interpolation_dimension_o2, interpolation_method_o2)]:
+        if itp not in ['zero', 'nan', 'none'] and axis == '2d':
+            return None
+    eem_stack_masked, rayleigh_mask_o1, rayleigh_mask_o2 = eem_rayleigh_scattering_removal(
+        eem_stack, ex_range, em_range, width_o1=width_o1, width_o2=width_o2,
+        interpolation_dimension_o1=interpolation_dimension_o1, interpolation_dimension_o2=interpolation_dimension_o2,
+        interpolation_method_o1=interpolation_method_o1, interpolation_method_o2=interpolation_method_o2)
+    return eem_stack_masked, [(rayleigh_mask_o1, rayleigh_mask_o2)] * eem_stack.shape[0]
+
+
+# Vectorized counterparts of EEM processing functions, used by process_eem_stack() to process all EEMs in one call.
+# They return the same outputs as applying the function to each EEM, or None if the EEMs have to be processed one by
+# one for the given parameters.
+_STACK_IMPLEMENTATIONS = {
+    eem_threshold_masking: _stack_threshold_masking,
+    eem_gaussian_filter: _stack_gaussian_filter,
+    eem_median_filter: _stack_median_filter,
+    eem_cutting: _stack_cutting,
+    eem_ife_correction: _stack_ife_correction,
+    eem_raman_normalization: _stack_raman_normalization,
+    eem_interpolation: _stack_interpolation,
+    eem_raman_scattering_removal: _stack_raman_scattering_removal,
+    eem_rayleigh_scattering_removal: _stack_rayleigh_scattering_removal,
+}
+
+
 def eems_tf_normalization(intensity):
     """
     Normalize EEMs by the total fluorescence of each EEM.
@@ -698,11 +956,8 @@ def eems_tf_normalization(intensity):
     weights: np.ndarray
         The total fluorescence of each EEM.
     """
-    tf_list = []
-    for i in range(intensity.shape[0]):
-        tf = intensity[i].sum()
-        tf_list.append(tf)
-    weights = np.array(tf_list) / np.mean(tf_list)
+    tf = intensity.sum(axis=(1, 2))
+    weights = tf / tf.mean()
     intensity_normalized = intensity / weights[:, np.newaxis, np.newaxis]
     return intensity_normalized, weights
 
@@ -766,41 +1021,75 @@ def eems_tf_normalization(intensity):
 #     return label
 
 
-def eems_fit_components(eem_stack, components, fit_intercept=False, positive=False):
+def eems_fit_components(eem_stack, components, fit_intercept=False, positive=False, components_pinv=None):
+    # components_pinv: optional pseudo-inverse of the unfolded components, shape (n_components, n_pixels), for
+    # repeated unconstrained fits without intercept against the same components.
     assert eem_stack.shape[1:] == components.shape[1:], "EEM and component have different shapes"
-    eem_stack[np.isnan(eem_stack)] = 0
+    # a masked copy, so that the EEM stack of the caller keeps its nan values
+    eem_stack = np.where(np.isnan(eem_stack), 0, eem_stack)
     components[np.isnan(components)] = 0
-    score_sample = []
-    fmax_sample = []
     max_values = np.amax(components, axis=(1, 2))
-    eem_stack_pred = np.zeros(eem_stack.shape)
-    for i in range(eem_stack.shape[0]):
-        y_true = eem_stack[i].reshape([-1])
-        x = components.reshape([components.shape[0], -1]).T
-        reg = LinearRegression(fit_intercept=fit_intercept, positive=positive)
-        reg.fit(x, y_true)
-        y_pred = reg.predict(x)
-        eem_stack_pred[i, :, :] = y_pred.reshape((eem_stack.shape[1], eem_stack.shape[2]))
-        score_sample.append(reg.coef_)
-        fmax_sample.append(reg.coef_ * max_values)
-    score_sample = np.array(score_sample)
-    fmax_sample = np.array(fmax_sample)
+    x = components.reshape([components.shape[0], -1]).T
+    if positive:
+        score_sample = []
+        eem_stack_pred = np.zeros(eem_stack.shape)
+        for i in range(eem_stack.shape[0]):
+            y_true = eem_stack[i].reshape([-1])
+            reg = LinearRegression(fit_intercept=fit_intercept, positive=positive)
+            reg.fit(x, y_true)
+            y_pred = reg.predict(x)
+            eem_stack_pred[i, :, :] = y_pred.reshape((eem_stack.shape[1], eem_stack.shape[2]))
+            score_sample.append(reg.coef_)
+        score_sample = np.array(score_sample)
+    else:
+        # The design matrix is shared by all samples, so the unconstrained fits reduce to a single least-squares solve
+        y_true = eem_stack.reshape([eem_stack.shape[0], -1]).T
+        if fit_intercept:
+            x = np.hstack([np.ones((x.shape[0], 1)), x])
+        if components_pinv is not None and not fit_intercept:
+            coef = components_pinv @ y_true
+        else:
+            coef = np.linalg.lstsq(x, y_true, rcond=None)[0]
+        eem_stack_pred = (x @ coef).T.reshape(eem_stack.shape)
+        score_sample = coef[1:].T if fit_intercept else coef.T
+    fmax_sample = score_sample * max_values
     return score_sample, fmax_sample, eem_stack_pred
 
 
 def eems_error(eem_stack_true, eem_stack_pred, metric: str = 'mse'):
     assert eem_stack_true.shape == eem_stack_pred.shape, "eem_stack_true and eem_stack_pred have different shapes"
-    error = []
-    for i in range(eem_stack_true.shape[0]):
-        y_true = eem_stack_true[i].reshape([-1])
-        y_pred = eem_stack_pred[i].reshape([-1])
-        if metric == 'mse':
-            error.append(mean_squared_error(y_true, y_pred))
-        elif metric == 'explained_variance':
-            error.append(explained_variance_score(y_true, y_pred))
-        elif metric == 'r2':
-            error.append(r2_score(y_true, y_pred))
-    return np.array(error)
+    y_true = eem_stack_true.reshape([eem_stack_true.shape[0], -1])
+    diff = y_true - eem_stack_pred.reshape([eem_stack_pred.shape[0], -1])
+    if metric == 'mse':
+        return np.einsum('ij,ij->i', diff, diff) / diff.shape[1]
+    elif metric in ['explained_variance', 'r2']:
+        numerator = np.var(diff, axis=1) if metric == 'explained_variance' \
+            else np.einsum('ij,ij->i', diff, diff) / diff.shape[1]
+        denominator = np.var(y_true, axis=1)
+        # same convention as sklearn for constant EEMs: 1 for a perfect prediction, 0 otherwise
+        error = np.where(numerator == 0, 1., 0.)
+        nonzero = denominator != 0
+        error[nonzero] = 1 - numerator[nonzero] / denominator[nonzero]
+        return error
+    return np.array([])
+
+
+def _pearson_correlation(x, y):
+    """
+    Calculate the Pearson correlation coefficient and its two-sided p-value between a 1d array x of length n and
+    every pixel of an EEM stack y of shape (n, i, j). If x is a 2d array of shape (n, v), the correlations of all v
+    variables are calculated at once and the results have a shape of (v, i, j).
+    """
+    n = x.shape[0]
+    xm = x - x.mean(axis=0)
+    ym = y - y.mean(axis=0)
+    # the squared norms are reduced with einsum to avoid materializing the squared arrays
+    r = np.einsum('n...,nij->...ij', xm, ym) / np.sqrt(np.einsum('n...,n...->...', xm, xm)[..., np.newaxis, np.newaxis]
+                                                        * np.einsum('nij,nij->ij', ym, ym))
+    r = np.clip(r, -1, 1)
+    t = r * np.sqrt((n - 2) / (1 - r ** 2))
+    p = 2 * stats.t.sf(np.abs(t), n - 2)
+    return r, p
 
 
 class EEMDataset:
@@ -822,14 +1111,18 @@ class EEMDataset:
     index: list or None
         Optional. The index used to label each sample. The number of elements in the list should equal the number
         of samples in the eem_stack.
+    dtype: np.dtype or None
+        Optional. The data type in which the eem_stack is stored, e.g., np.float32 to halve the memory footprint and
+        memory traffic of large datasets (EEM intensities rarely have more than 5 significant digits). If None, the
+        data type of eem_stack is kept. In both cases the eem_stack is stored as a C-contiguous array.
     """
 
     def __init__(self, eem_stack: np.ndarray, ex_range: np.ndarray, em_range: np.ndarray,
-                 index: Optional[list] = None, ref: Optional[pd.DataFrame] = None):
+                 index: Optional[list] = None, ref: Optional[pd.DataFrame] = None, dtype=None):
 
         # ------------------parameters--------------------
         # The Em/Ex ranges should be sorted in ascending order
-        self.eem_stack = eem_stack
+        self.eem_stack = np.ascontiguousarray(eem_stack, dtype=dtype)
         self.ex_range = ex_range
         self.em_range = em_range
         self.ref = ref
@@ -906,7 +1199,7 @@ class EEMDataset:
         """
         return self.eem_stack.sum(axis=(1, 2))
 
-    def regional_integration(self, em_boundary, ex_boundary):
+    def regional_integration(self, ex_min, ex_max, em_min, em_max):
         """
         Calculate regional integration of samples.
 
@@ -918,8 +1211,8 @@ class EEMDataset:
         -------
         integrations: np.ndarray
         """
-        integrations, _ = process_eem_stack(self.eem_stack, eem_regional_integration, ex_range=self.ex_range,
-                                            em_range=self.em_range, em_boundary=em_boundary, ex_boundary=ex_boundary)
+        integrations, _ = eem_regional_integration(self.eem_stack, self.ex_range, self.em_range,
+                                                   ex_min=ex_min, ex_max=ex_max, em_min=em_min, em_max=em_max)
         return integrations
 
     def peak_picking(self, ex, em):
@@ -970,36 +1263,35 @@ class EEMDataset:
             A dictionary containing multiple correlation evaluation metrics.
         """
         m = self.eem_stack
+        n = m.shape[0]
+        # pixels containing nan values cannot be fitted and are reported as nan
+        invalid = np.isnan(m).any(axis=0)
+        m_ranked = stats.rankdata(m, axis=0)
         corr_dict = {var: None for var in variables}
-        for var in variables:
-            x = np.array(self.ref.loc[:, [var]])
-            w = np.full((m.shape[1], m.shape[2]), fill_value=np.nan)
-            b = np.full((m.shape[1], m.shape[2]), fill_value=np.nan)
-            r2 = np.full((m.shape[1], m.shape[2]), fill_value=np.nan)
-            pc = np.full((m.shape[1], m.shape[2]), fill_value=np.nan)
-            pc_p = np.full((m.shape[1], m.shape[2]), fill_value=np.nan)
-            sc = np.full((m.shape[1], m.shape[2]), fill_value=np.nan)
-            sc_p = np.full((m.shape[1], m.shape[2]), fill_value=np.nan)
-            e = np.full(m.shape, fill_value=np.nan)
-            for i in range(m.shape[1]):
-                for j in range(m.shape[2]):
-                    try:
-                        y = (m[:, i, j])
-                        reg = LinearRegression(fit_intercept=fit_intercept)
-                        reg.fit(x, y)
-                        w[i, j] = reg.coef_
-                        b[i, j] = reg.intercept_
-                        r2[i, j] = reg.score(x, y)
-                        e[:, i, j] = reg.predict(x) - y
-                        pc[i, j] = stats.pearsonr(x.reshape(-1), y).statistic
-                        pc_p[i, j] = stats.pearsonr(x.reshape(-1), y).pvalue
-                        sc[i, j] = stats.spearmanr(x.reshape(-1), y).statistic
-                        sc_p[i, j] = stats.spearmanr(x.reshape(-1), y).pvalue
-                    except ValueError:
-                        pass
-            corr_dict.var = {'slope': w, 'intercept': b, 'r_square': r2, 'linear regression residual': e,
-                         'Pearson corr. coef.': pc, 'Pearson corr. coef. p-value': pc_p, 'Spearman corr. coef.': sc,
-                         'Spearman corr. coef. p-value': sc_p}
+        # the Pearson and Spearman correlations of all variables are calculated in a single batched call
+        x_all = np.array(self.ref.loc[:, variables], dtype=float).reshape([n, -1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pc_all, pc_p_all = _pearson_correlation(x_all, m)
+            sc_all, sc_p_all = _pearson_correlation(stats.rankdata(x_all, axis=0), m_ranked)
+        for k, var in enumerate(variables):
+            x = x_all[:, k]
+            pc, pc_p, sc, sc_p = pc_all[k], pc_p_all[k], sc_all[k], sc_p_all[k]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # closed-form least squares fitted to all pixels at once
+                if fit_intercept:
+                    w = np.einsum('n,nij->ij', x - x.mean(), m - m.mean(axis=0)) / np.sum((x - x.mean()) ** 2)
+                    b = m.mean(axis=0) - w * x.mean()
+                else:
+                    w = np.einsum('n,nij->ij', x, m) / np.sum(x ** 2)
+                    b = np.zeros(w.shape)
+                e = x[:, np.newaxis, np.newaxis] * w + b - m
+                r2 = 1 - np.sum(e ** 2, axis=0) / np.sum((m - m.mean(axis=0)) ** 2, axis=0)
+            for metric in (w, b, r2, pc, pc_p, sc, sc_p):
+                metric[invalid] = np.nan
+            e[:, invalid] = np.nan
+            corr_dict[var] = {'slope': w, 'intercept': b, 'r_square': r2, 'linear regression residual': e,
+                              'Pearson corr. coef.': pc, 'Pearson corr. coef. p-value': pc_p,
+                              'Spearman corr. coef.': sc, 'Spearman corr. coef. p-value': sc_p}
         return corr_dict
 
     # -----------------EEM dataset processing methods-----------------
@@ -1092,12 +1384,55 @@ class EEMDataset:
         eem_stack_masked, _ = process_eem_stack(
             self.eem_stack, eem_region_masking, ex_range=self.ex_range,
             em_range=self.em_range, ex_min=ex_min, ex_max=ex_max, em_min=em_min,
-            em_max=em_max, fill_value=fill_value
+            em_max=em_max, fill=fill_value
         )
         if not copy:
             self.eem_stack = eem_stack_masked
         return eem_stack_masked
 
+    def apply_masks(self, threshold=None, mask_type='greater', region=None, fill=np.nan, copy=True):
+        """
+        Mask the fluorescence intensities above or below a certain threshold and/or in a specified rectangular region,
+        in one pass over the EEM stack. This is equivalent to chaining threshold_masking() and region_masking() with
+        the same fill value, without building the intermediate EEM stacks.
+
+        Parameters
+        ----------
+        threshold: float or None
+            The threshold. If None, no threshold masking is applied.
+        mask_type: str, {"greater","smaller"}
+            Whether to mask the intensities greater or smaller than the threshold.
+        region: tuple of four floats or None
+            The boundaries (ex_min, ex_max, em_min, em_max) of the masked region. If None, no region masking is
+            applied.
+        fill: float
+            The value to fill the masked area.
+        copy: bool
+            if False, overwrite the EEMDataset object with the processed EEMs.
+
+        Returns
+        -------
+        eem_stack_masked: np.ndarray
+            The masked EEM.
+        mask: np.ndarray
+            The mask matrix. +1: unmasked area; np.nan: masked area.
+        """
+        masked = np.zeros(self.eem_stack.shape, dtype=bool)
+        if threshold is not None:
+            if mask_type == 'smaller':
+                np.less(self.eem_stack, threshold, out=masked)
+            elif mask_type == 'greater':
+                np.greater(self.eem_stack, threshold, out=masked)
+        if region is not None:
+            _, region_mask = eem_region_masking(self.eem_stack[0], self.ex_range, self.em_range, *region)
+            masked |= region_mask == 0
+        eem_stack_masked = np.where(masked, fill, self.eem_stack).astype(np.result_type(self.eem_stack, np.float32),
+                                                                         copy=False)
+        mask = np.where(masked, np.nan, 1.)
+        if not copy:
+            self.eem_stack = eem_stack_masked
+        return eem_stack_masked, mask
+
     def cutting(self, ex_min, ex_max, em_min, em_max, copy=True):
         """
         Calculate the regional fluorescence integration (RFI) over a rectangular region.
@@ -1320,9 +1655,10 @@ class EEMDataset:
     #                                        tf_normalization=tf_normalization, grid_size=grid_size,
     #                                        contamination=contamination)
     #     if deletion:
-    #         self.eem_stack = self.eem_stack[labels != -1]
-    #         self.ref = self.ref[labels != -1]
-    #         self.index = [idx for i, idx in enumerate(self.index) if labels[i] != -1]
+    #         inlier = labels != -1
+    #         self.eem_stack = self.eem_stack[inlier]
+    #         self.ref = self.ref[inlier] if self.ref is not None else None
+    #         self.index = np.asarray(self.index, dtype=object)[inlier].tolist() if self.index else None
     #     return labels
     #
     # def outlier_detection_ocs(self, tf_normalization=True, grid_size=(10, 10), nu=0.02, kernel='rbf', gamma=10000,
@@ -1331,9 +1667,10 @@ class EEMDataset:
     #                                         tf_normalization=tf_normalization, grid_size=grid_size, nu=nu,
     #                                         kernel=kernel, gamma=gamma)
     #     if deletion:
-    #         self.eem_stack = self.eem_stack[labels != -1]
-    #         self.ref = self.ref[labels != -1]
-    #         self.index = [idx for i, idx in enumerate(self.index) if labels[i] != -1]
+    #         inlier = labels != -1
+    #         self.eem_stack = self.eem_stack[inlier]
+    #         self.ref = self.ref[inlier] if self.ref is not None else None
+    #         self.index = np.asarray(self.index, dtype=object)[inlier].tolist() if self.index else None
     #     return labels
 
     def splitting(self, n_split, rule: str = 'random'):
@@ -1353,25 +1690,23 @@ class EEMDataset:
         model_list: list.
             A list of sub-datasets. Each of them is an EEMDataset object.
         """
-        idx_eems = [i for i in range(self.eem_stack.shape[0])]
         model_list = []
         if rule == 'random':
-            random.shuffle(idx_eems)
-            idx_splits = np.array_split(idx_eems, n_split)
+            idx_splits = np.array_split(np.random.permutation(self.eem_stack.shape[0]), n_split)
         elif rule == 'sequential':
-            idx_splits = np.array_split(idx_eems, n_split)
+            idx_splits = np.array_split(np.arange(self.eem_stack.shape[0]), n_split)
         else:
             raise ValueError("'rule' should be either 'random' or 'sequential'")
         for split in idx_splits:
             if self.ref is not None:
-                ref = np.array([self.ref.iloc[i] for i in split])
+                ref = np.array(self.ref.iloc[split])
             else:
                 ref = None
             if self.index:
-                index = [self.index[i] for i in split]
+                index = np.asarray(self.index, dtype=object)[split].tolist()
             else:
                 index = None
-            m = EEMDataset(eem_stack=np.array([self.eem_stack[i] for i in split]), ex_range=self.ex_range,
+            m = EEMDataset(eem_stack=self.eem_stack[split], ex_range=self.ex_range,
                            em_range=self.em_range, ref=ref, index=index)
             model_list.append(m)
         return model_list
@@ -1402,10 +1737,10 @@ class EEMDataset:
         selected_indices = np.random.choice(n_samples, size=int(n_samples * portion), replace=False)
         eem_stack_new = self.eem_stack[selected_indices, :, :]
         if self.index:
-            index_new = [self.index[i] for i in selected_indices]
+            index_new = np.asarray(self.index, dtype=object)[selected_indices].tolist()
         else:
             index_new = None
-        if self.ref:
+        if self.ref is not None:
             ref_new = self.ref.iloc[selected_indices]
         else:
             ref_new = None
@@ -1426,9 +1761,9 @@ class EEMDataset:
         """
         sorted_indices = np.argsort(self.index)
         self.eem_stack = self.eem_stack[sorted_indices]
-        if self.ref:
+        if self.ref is not None:
             self.ref = self.ref.iloc[sorted_indices]
-        self.index = sorted(self.index)
+        self.index = np.asarray(self.index, dtype=object)[sorted_indices].tolist()
         return sorted_indices
 
     # def sort_by_ref(self):
@@ -1477,23 +1812,20 @@ class EEMDataset:
             mandatory_keywords = [mandatory_keywords]
         if isinstance(optional_keywords, str):
             optional_keywords = [optional_keywords]
-        sample_number_mandatory_filtered = []
-        sample_number_all_filtered = []
-
-        if mandatory_keywords:
-            for i, f in enumerate(self.index):
-                if all(kw in f for kw in mandatory_keywords):
-                    sample_number_mandatory_filtered.append(i)
-        else:
-            sample_number_mandatory_filtered = list(range(len(self.index)))
-
+        # one boolean mask per keyword, combined with AND (mandatory) / OR (optional) instead of nested loops
+        n = len(self.index)
+        selected = np.ones(n, dtype=bool)
+        for kw in mandatory_keywords or []:
+            selected &= np.fromiter((kw in f for f in self.index), dtype=bool, count=n)
         if optional_keywords:
-            for j in sample_number_mandatory_filtered:
-                if any(kw in self.index[j] for kw in optional_keywords):
-                    sample_number_all_filtered.append(j)
+            selected &= np.logical_or.reduce(
+                [np.fromiter((kw in f for f in self.index), dtype=bool, count=n) for kw in optional_keywords])
+        sample_number_all_filtered = np.flatnonzero(selected).tolist()
+        if not copy and selected.all():
+            # nothing is filtered out and the dataset is overwritten anyway, so the EEM stack is kept as is
+            eem_stack_filtered = self.eem_stack
         else:
-            sample_number_all_filtered = sample_number_mandatory_filtered
-        eem_stack_filtered = self.eem_stack[sample_number_all_filtered, :, :]
+            eem_stack_filtered = self.eem_stack[sample_number_all_filtered, :, :]
         index_filtered = [self.index[i] for i in sample_number_all_filtered]
         ref_filtered = self.ref.iloc[sample_number_all_filtered] if self.ref is not None else None
         if not copy:
@@ -1517,13 +1849,16 @@ def combine_eem_datasets(list_eem_datasets):
     eem_dataset_combined: EEMDataset
         EEM dataset combined.
     """
-    eem_stack_combined = []
     ref_combined = []
     index_combined = []
     ex_range_0 = list_eem_datasets[0].ex_range
     em_range_0 = list_eem_datasets[0].em_range
-    for d in list_eem_datasets:
-        eem_stack_combined.append(d.eem_stack)
+    # the combined stack is allocated once and filled dataset by dataset
+    n_samples = [d.eem_stack.shape[0] for d in list_eem_datasets]
+    eem_stack_combined = np.empty((sum(n_samples),) + list_eem_datasets[0].eem_stack.shape[1:],
+                                  dtype=np.result_type(*[d.eem_stack for d in list_eem_datasets]))
+    offsets = np.cumsum([0] + n_samples)
+    for d, start, stop in zip(list_eem_datasets, offsets[:-1], offsets[1:]):
         ref_combined.append(d.ref if d.ref is not None else np.array(d.eem_stack.shape[0] * [np.nan]))
         if d.index:
             index_combined = index_combined + d.index
@@ -1534,7 +1869,7 @@ def combine_eem_datasets(list_eem_datasets):
                 'ex_range and em_range of the datasets must be identical. If you want to combine EEM datasets '
                 'having different ex/em ranges, please consider unify the ex/em ranges using the interpolation() '
                 'method of EEMDataset object')
-    eem_stack_combined = np.concatenate(eem_stack_combined, axis=0)
+        eem_stack_combined[start:stop] = d.eem_stack
     ref_combined = np.concatenate(ref_combined, axis=0)
     eem_dataset_combined = EEMDataset(eem_stack=eem_stack_combined, ex_range=ex_range_0, em_range=em_range_0,
                                       ref=ref_combined, index=index_combined)
@@ -1551,8 +1886,9 @@ class PARAFAC:
         The number of components
     non_negativity: bool
         Whether to apply the non-negativity constraint
-    init: str or tensorly.CPTensor, {‘svd’, ‘random’, CPTensor}
-        Type of factor matrix initialization
+    init: str or tensorly.CPTensor, {‘svd’, ‘randomized_svd’, ‘random’, CPTensor}
+        Type of factor matrix initialization. 'randomized_svd' initializes with a randomized truncated SVD, which is
+        cheaper than the full SVD when the rank is much smaller than the EEM dimensions.
     tf_normalization: bool
         Whether to normalize the EEMs by the total fluorescence in PARAFAC model establishment
     loadings_normalization: str or None, {'sd', 'maximum', None}
@@ -1605,9 +1941,12 @@ class PARAFAC:
         self.components = None
         self.cptensors = None
         self.eem_stack_train = None
-        self.eem_stack_reconstructed = None
+        self._eem_stack_reconstructed = None
         self.ex_range = None
         self.em_range = None
+        self._rmse = None
+        self._sample_mean = None
+        self._pinv_cache = None
 
     # --------------methods------------------
     def fit(self, eem_dataset: EEMDataset):
@@ -1626,53 +1965,51 @@ class PARAFAC:
         """
         if self.tf_normalization:
             _, tf_weights = eem_dataset.tf_normalization(copy=False)
+        # a single NaN scan; the boolean array is reused as a uint8 mask (1: observed, 0: missing)
+        nan_loc = np.isnan(eem_dataset.eem_stack)
+        if nan_loc.any():
+            # tensorly multiplies the tensor by the mask, so the missing values are set to 0 (nan * 0 is still nan)
+            eem_stack = np.where(nan_loc, 0, eem_dataset.eem_stack)
+            mask = np.logical_not(nan_loc, out=nan_loc).view(np.uint8)
+        else:
+            eem_stack, mask = eem_dataset.eem_stack, None
+        if isinstance(self.init, str) and self.init == 'randomized_svd':
+            init, svd = 'svd', 'randomized_svd'
+        else:
+            init, svd = self.init, 'truncated_svd'
         try:
             if not self.non_negativity:
-                if np.isnan(eem_dataset.eem_stack).any():
-                    mask = np.where(np.isnan(eem_dataset.eem_stack), 0, 1)
-                    cptensors = parafac(eem_dataset.eem_stack, rank=self.rank, mask=mask, init=self.init)
-                else:
-                    cptensors = parafac(eem_dataset.eem_stack, rank=self.rank, init=self.init)
+                cptensors = parafac(eem_stack, rank=self.rank, mask=mask, init=init, svd=svd)
             else:
-                if np.isnan(eem_dataset.eem_stack).any():
-                    mask = np.where(np.isnan(eem_dataset.eem_stack), 0, 1)
-                    cptensors = non_negative_parafac(eem_dataset.eem_stack, rank=self.rank, mask=mask, init=self.init)
-                else:
-                    cptensors = non_negative_parafac(eem_dataset.eem_stack, rank=self.rank, init=self.init)
+                cptensors = non_negative_parafac(eem_stack, rank=self.rank, mask=mask, init=init, svd=svd)
         except ArpackError:
             print(
                 "PARAFAC failed possibly due to the presence of patches of nan values. Please consider cut or "
                 "interpolate the nan values.")
         a, b, c = cptensors[1]
-        components = np.zeros([self.rank, b.shape[0], c.shape[0]])
-        for r in range(self.rank):
-
-            # when non_negativity is not applied, ensure the scores are generally positive
-            if not self.non_negativity:
-                if a[:, r].sum() < 0:
-                    a[:, r] = -a[:, r]
-                    if abs(b[:, r].min()) > b[:, r].max():
-                        b[:, r] = -b[:, r]
-                    else:
-                        c[:, r] = -c[:, r]
-                elif abs(b[:, r].min()) > b[:, r].max() and abs(c[:, r].min()) > c[:, r].max():
-                    b[:, r] = -b[:, r]
-                    c[:, r] = -c[:, r]
-
-            if self.loadings_normalization == 'sd':
-                stdb = b[:, r].std()
-                stdc = c[:, r].std()
-                b[:, r] = b[:, r] / stdb
-                c[:, r] = c[:, r] / stdc
-                a[:, r] = a[:, r] * stdb * stdc
-            elif self.loadings_normalization == 'maximum':
-                maxb = b[:, r].max()
-                maxc = c[:, r].min()
-                b[:, r] = b[:, r] / maxb
-                c[:, r] = c[:, r] / maxc
-                a[:, r] = a[:, r] * maxb * maxc
-            component = np.array([b[:, r]]).T.dot(np.array([c[:, r]]))
-            components[r, :, :] = component
+        # when non_negativity is not applied, ensure the scores are generally positive
+        if not self.non_negativity:
+            flip_a = a.sum(axis=0) < 0
+            b_negative = np.abs(b.min(axis=0)) > b.max(axis=0)
+            c_negative = np.abs(c.min(axis=0)) > c.max(axis=0)
+            flip_bc = ~flip_a & b_negative & c_negative
+            a *= np.where(flip_a, -1, 1)
+            b *= np.where((flip_a & b_negative) | flip_bc, -1, 1)
+            c *= np.where((flip_a & ~b_negative) | flip_bc, -1, 1)
+
+        if self.loadings_normalization == 'sd':
+            stdb = b.std(axis=0)
+            stdc = c.std(axis=0)
+            b /= stdb
+            c /= stdc
+            a *= stdb * stdc
+        elif self.loadings_normalization == 'maximum':
+            maxb = b.max(axis=0)
+            maxc = c.max(axis=0)
+            b /= maxb
+            c /= maxc
+            a *= maxb * maxc
+        components = np.einsum('jr,kr->rjk', b, c)
 
         if self.tf_normalization:
             a = np.multiply(a, tf_weights[:, np.newaxis])
@@ -1681,18 +2018,15 @@ class PARAFAC:
         ex_loadings = pd.DataFrame(np.flipud(b), index=eem_dataset.ex_range)
         em_loadings = pd.DataFrame(c, index=eem_dataset.em_range)
         if self.sort_em:
-            em_peaks = [c for c in em_loadings.idxmax()]
-            peak_rank = list(enumerate(stats.rankdata(em_peaks)))
-            order = [i[0] for i in sorted(peak_rank, key=lambda x: x[1])]
+            order = np.argsort(em_loadings.to_numpy().argmax(axis=0), kind='stable')
             components = components[order]
-            ex_loadings = pd.DataFrame({'component {r} ex loadings'.format(r=i + 1): ex_loadings.iloc[:, order[i]]
-                                        for i in range(self.rank)})
-            em_loadings = pd.DataFrame({'component {r} em loadings'.format(r=i + 1): em_loadings.iloc[:, order[i]]
-                                        for i in range(self.rank)})
-            score = pd.DataFrame({'component {r} score'.format(r=i + 1): score.iloc[:, order[i]]
-                                  for i in range(self.rank)})
-            fmax = pd.DataFrame({'component {r} fmax'.format(r=i + 1): fmax[:, order[i]]
-                                 for i in range(self.rank)})
+            ex_loadings = ex_loadings.iloc[:, order]
+            ex_loadings.columns = ['component {r} ex loadings'.format(r=i + 1) for i in range(self.rank)]
+            em_loadings = em_loadings.iloc[:, order]
+            em_loadings.columns = ['component {r} em loadings'.format(r=i + 1) for i in range(self.rank)]
+            score = score.iloc[:, order]
+            score.columns = ['component {r} score'.format(r=i + 1) for i in range(self.rank)]
+            fmax = pd.DataFrame(fmax[:, order], columns=['component {r} fmax'.format(r=i + 1) for i in range(self.rank)])
         else:
             column_labels = ['component {r}'.format(r=i + 1) for i in range(self.rank)]
             ex_loadings.columns = column_labels
@@ -1719,9 +2053,20 @@ class PARAFAC:
         self.eem_stack_train = eem_dataset.eem_stack
         self.ex_range = eem_dataset.ex_range
         self.em_range = eem_dataset.em_range
-        self.eem_stack_reconstructed = cp_to_tensor(cptensors)
+        self._eem_stack_reconstructed = None
+        self._rmse = None
+        self._sample_mean = None
         return self
 
+    @property
+    def eem_stack_reconstructed(self):
+        # The reconstruction is as large as the training stack, so it is only built when it is first needed, in the
+        # floating dtype of the training stack (e.g. float32 for an EEMDataset stored in float32).
+        if self._eem_stack_reconstructed is None and self.cptensors is not None:
+            self._eem_stack_reconstructed = cp_to_tensor(self.cptensors).astype(
+                np.result_type(self.eem_stack_train, np.float32), copy=False)
+        return self._eem_stack_reconstructed
+
     def predict(self, eem_dataset: EEMDataset, fit_intercept=False):
         """
         Predict the score and Fmax of a given EEM dataset using the component fitted. This method can be applied to a
@@ -1743,12 +2088,24 @@ class PARAFAC:
         eem_stack_pred: np.ndarray (3d)
             The EEM dataset reconstructed.
         """
+        # the pseudo-inverse only applies to fits without intercept
+        components_pinv = None if fit_intercept else self._components_pinv()
         score_sample, fmax_sample, eem_stack_pred = eems_fit_components(eem_dataset.eem_stack, self.components,
-                                                                        fit_intercept=fit_intercept)
+                                                                        fit_intercept=fit_intercept,
+                                                                        components_pinv=components_pinv)
         score_sample = pd.DataFrame(score_sample, index=eem_dataset.index, columns=self.score.columns)
         fmax_sample = pd.DataFrame(fmax_sample, index=eem_dataset.index, columns=self.fmax.columns)
         return score_sample, fmax_sample, eem_stack_pred
 
+    def _components_pinv(self):
+        # The pseudo-inverse of the unfolded components turns every later prediction into a single matrix product.
+        # It is cached together with the components it was computed from, so that a new components array (e.g. after
+        # fit() or align_parafac_components()) invalidates it.
+        if self._pinv_cache is None or self._pinv_cache[0] is not self.components:
+            x = np.nan_to_num(self.components.reshape([self.components.shape[0], -1]))
+            self._pinv_cache = (self.components, np.linalg.pinv(x.T))
+        return self._pinv_cache[1]
+
     def component_peak_locations(self):
         """
         Get the ex/em of component peaks
@@ -1758,10 +2115,9 @@ class PARAFAC:
         max_exem: list
             A List of (ex, em) of component peaks.
         """
-        max_exem = []
-        for r in range(self.rank):
-            max_index = np.unravel_index(np.argmax(self.components[r, :, :]), self.components[r, :, :].shape)
-            max_exem.append((self.ex_range[-(max_index[0] + 1)], self.em_range[max_index[1]]))
+        ex_index, em_index = np.unravel_index(self.components.reshape([self.rank, -1]).argmax(axis=1),
+                                              self.components.shape[1:])
+        max_exem = list(zip(self.ex_range[-(ex_index + 1)], self.em_range[em_index]))
         return max_exem
 
     def residual(self):
@@ -1841,9 +2197,7 @@ class PARAFAC:
         sse: pandas.DataFrame
             Table of RMSE
         """
-        res = self.residual()
-        n_pixels = self.eem_stack_train.shape[1] * self.eem_stack_train.shape[2]
-        rmse = pd.DataFrame(sqrt(np.sum(res ** 2, axis=(1, 2)) / n_pixels), index=self.score.index)
+        rmse = pd.DataFrame(self._sample_rmse(), index=self.score.index)
         return rmse
 
     def sample_normalized_rmse(self):
@@ -1856,13 +2210,20 @@ class PARAFAC:
         normalized_sse: pandas.DataFrame
             Table of normalized RMSE
         """
-        res = self.residual()
-        n_pixels = self.eem_stack_train.shape[1] * self.eem_stack_train.shape[2]
-        normalized_sse = pd.DataFrame(sqrt(np.sum(res ** 2, axis=(1, 2)) / n_pixels) /
-                                      np.average(self.eem_stack_train, axis=(1, 2)),
-                                      index=self.score.index)
+        if self._sample_mean is None:
+            self._sample_mean = self.eem_stack_train.mean(axis=(1, 2))
+        normalized_sse = pd.DataFrame(self._sample_rmse() / self._sample_mean, index=self.score.index)
         return normalized_sse
 
+    def _sample_rmse(self):
+        # The RMSE of each sample is shared by sample_rmse(), sample_normalized_rmse() and sample_summary(), so the
+        # residual is only computed once per fitted model.
+        if self._rmse is None:
+            res = self.residual()
+            sse = np.einsum('ijk,ijk->i', res, res)
+            self._rmse = np.sqrt(sse / (res.shape[1] * res.shape[2]), out=sse)
+        return self._rmse
+
     def sample_summary(self):
         """
         Get a table showing the score, Fmax, leverage, RMSE and normalized RMSE for each sample.
@@ -1910,21 +2271,19 @@ class PARAFAC:
         score.index = pd.MultiIndex.from_tuples(list(zip(*[score_column, self.score.index])),
                                                 names=('type', 'time'))
 
+        # all sections are streamed through one file handle. The line terminator of to_csv is set to '\n' so that
+        # the text mode of the handle translates it consistently with the header lines.
         with open(filepath, 'w') as f:
             f.write('# \n# Fluorescence Model \n# \n')
             for key, value in info_dict.items():
                 f.write(key + '\t' + value)
                 f.write('\n')
             f.write('# \n# Excitation/Emission (Ex, Em), wavelength [nm], component_n [loading] \n# \n')
-            f.close()
-        with pd.option_context('display.multi_sparse', False):
-            exl.to_csv(filepath, mode='a', sep="\t", header=None)
-            eml.to_csv(filepath, mode='a', sep="\t", header=None)
-        with open(filepath, 'a') as f:
+            with pd.option_context('display.multi_sparse', False):
+                exl.to_csv(f, sep="\t", header=None, lineterminator='\n')
+                eml.to_csv(f, sep="\t", header=None, lineterminator='\n')
             f.write('# \n# timestamp, component_n [Score] \n# \n')
-            f.close()
-        score.to_csv(filepath, mode='a', sep="\t", header=None)
-        with open(filepath, 'a') as f:
+            score.to_csv(f, sep="\t", header=None, lineterminator='\n')
             f.write('# end #')
         return info_dict
 
@@ -1962,21 +2321,39 @@ def loadings_similarity(loadings1: pd.DataFrame, loadings2: pd.DataFrame, wavele
         elif wl_interval1 > wl_interval2:
             f1 = interp1d(wl_range1, loadings1.to_numpy(), axis=0)
             loadings1 = f1(wl_range2)
-    else:
-        loadings1, loadings2 = (loadings1.to_numpy(), loadings2.to_numpy())
-    m_sim = np.zeros([loadings1.shape[1], loadings2.shape[1]])
-    for n2 in range(loadings2.shape[1]):
-        for n1 in range(loadings1.shape[1]):
-            if dtw:
+    loadings1, loadings2 = (np.asarray(loadings1, dtype=float), np.asarray(loadings2, dtype=float))
+    if dtw:
+        m_sim = np.zeros([loadings1.shape[1], loadings2.shape[1]])
+        for n2 in range(loadings2.shape[1]):
+            for n1 in range(loadings1.shape[1]):
                 ex1_aligned, ex2_aligned = dynamic_time_warping(loadings1[:, n1], loadings2[:, n2])
-            else:
-                ex1_aligned, ex2_aligned = [loadings1[:, n1], loadings2[:, n2]]
-            m_sim[n1, n2] = stats.pearsonr(ex1_aligned, ex2_aligned)[0]
+                # only the coefficient is needed, so the p-value of stats.pearsonr is not computed
+                m_sim[n1, n2] = _matched_loadings_similarity(np.asarray(ex1_aligned, dtype=float)[:, np.newaxis],
+                                                             np.asarray(ex2_aligned, dtype=float)[:, np.newaxis])[0]
+    else:
+        # Pearson correlation between all pairs of columns with a single matrix product
+        centered1 = loadings1 - loadings1.mean(axis=0)
+        centered2 = loadings2 - loadings2.mean(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m_sim = centered1.T @ centered2 / np.outer(np.linalg.norm(centered1, axis=0),
+                                                        np.linalg.norm(centered2, axis=0))
+        m_sim = np.clip(m_sim, -1, 1)
     m_sim = pd.DataFrame(m_sim, index=['model1 C{i}'.format(i=i + 1) for i in range(loadings1.shape[1])],
                          columns=['model2 C{i}'.format(i=i + 1) for i in range(loadings2.shape[1])])
     return m_sim
 
 
+def _matched_loadings_similarity(loadings1, loadings2):
+    # Same similarity as loadings_similarity() (without alignment or DTW), but only between components with the same
+    # position, for stacks of loadings with a shape of (..., n_wavelengths, n_components).
+    centered1 = loadings1 - loadings1.mean(axis=-2, keepdims=True)
+    centered2 = loadings2 - loadings2.mean(axis=-2, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m_sim = np.einsum('...ij,...ij->...j', centered1, centered2) / (np.linalg.norm(centered1, axis=-2) *
+                                                                        np.linalg.norm(centered2, axis=-2))
+    return np.clip(m_sim, -1, 1)
+
+
 def align_parafac_components(models_dict: dict, ex_ref: pd.DataFrame, em_ref: pd.DataFrame, wavelength_alignment=False):
     """
     Align the components of PARAFAC models according to given reference ex/em loadings so that similar components
@@ -2007,28 +2384,18 @@ def align_parafac_components(models_dict: dict, ex_ref: pd.DataFrame, em_ref: pd
         m_sim_em = loadings_similarity(model.em_loadings, em_ref, wavelength_alignment=wavelength_alignment)
         m_sim = (m_sim_ex + m_sim_em) / 2
         ex_var, em_var = (model.ex_loadings, model.em_loadings)
-        matched_index = []
-        m_sim_copy = m_sim.copy()
+        # optimal one-to-one matching between the components of the model and the reference
+        var_index, ref_index = linear_sum_assignment(-m_sim.to_numpy())
         if ex_var.shape[1] <= ex_ref.shape[1]:
-            for n_var in range(ex_var.shape[1]):
-                max_index = np.argmax(m_sim.iloc[n_var, :])
-                while max_index in matched_index:
-                    m_sim_copy.iloc[n_var, max_index] = 0
-                    max_index = np.argmax(m_sim_copy.iloc[n_var, :])
-                matched_index.append(max_index)
+            matched_index = ref_index.tolist()
             component_labels_var = [component_labels_ref[i] for i in matched_index]
             permutation = get_indices_smallest_to_largest(matched_index)
         else:
-            for n_ref in range(ex_ref.shape[1]):
-                max_index = np.argmax(m_sim.iloc[:, n_ref])
-                while max_index in matched_index:
-                    m_sim_copy.iloc[max_index, n_ref] = 0
-                    max_index = np.argmax(m_sim_copy.iloc[:, n_ref])
-                matched_index.append(max_index)
+            matched_index = var_index[np.argsort(ref_index)].tolist()
             non_ordered_index = list(set([i for i in range(ex_var.shape[1])]) - set(matched_index))
             permutation = matched_index + non_ordered_index
-            component_labels_ref_extended = component_labels_ref + ['O{i}'.format(i=i + 1) for i in
-                                                                    range(len(non_ordered_index))]
+            component_labels_ref_extended = list(component_labels_ref) + ['O{i}'.format(i=i + 1) for i in
+                                                                          range(len(non_ordered_index))]
             component_labels_var = [0] * len(permutation)
             for i, nc in enumerate(permutation):
                 component_labels_var[nc] = component_labels_ref_extended[i]
@@ -2039,11 +2406,32 @@ def align_parafac_components(models_dict: dict, ex_ref: pd.DataFrame, em_ref: pd
         model.em_loadings = model.em_loadings.iloc[:, permutation]
         model.fmax = model.fmax.iloc[:, permutation]
         model.components = model.components[permutation, :, :]
-        model.cptensor = permute_cp_tensor(model.cptensors, permutation)
+        model.cptensors = permute_cp_tensor(model.cptensors, permutation)
         models_dict_new[model_label] = model
     return models_dict_new
 
 
+def _fit_parafac_on_subsets(eem_datasets, rank, non_negativity, tf_normalization, init='svd', init_loadings=None):
+    # Establish a PARAFAC model on the combination of several EEM sub-datasets. The combined dataset is returned
+    # with the model because PARAFAC.fit() normalizes it in place, which does not propagate back from worker processes.
+    # If init_loadings (the ex and em factor matrices of a reference model) is given, ALS is warm-started from them,
+    # with the scores initialized by least squares.
+    subdataset = combine_eem_datasets(eem_datasets)
+    if init_loadings is not None:
+        b, c = init_loadings
+        eem_stack = eems_tf_normalization(subdataset.eem_stack)[0] if tf_normalization else subdataset.eem_stack
+        kr = np.einsum('jr,kr->jkr', b, c).reshape([-1, rank])
+        y = np.nan_to_num(eem_stack.reshape([eem_stack.shape[0], -1])).T
+        a = np.linalg.lstsq(kr, y, rcond=None)[0].T
+        if non_negativity:
+            a = np.maximum(a, 0)
+        init = CPTensor((np.ones(rank), [a, b.copy(), c.copy()]))
+    model_subdataset = PARAFAC(rank=rank, non_negativity=non_negativity, init=init,
+                               tf_normalization=tf_normalization)
+    model_subdataset.fit(subdataset)
+    return model_subdataset, subdataset
+
+
 class SplitValidation:
     """
     Conduct PARAFAC model validation by evaluating the consistency of PARAFAC models established on EEM sub-datasets.
@@ -2064,6 +2452,15 @@ class SplitValidation:
         Whether to apply non-negativity constraint in PARAFAC.
     tf_normalization: bool
         Whether to normalize the EEM by total fluorescence in PARAFAC.
+    init: str, {'svd', 'randomized_svd', 'random'}
+        Type of factor matrix initialization in PARAFAC. See eempy.eem_processing.PARAFAC.
+    n_jobs: int or None
+        The number of parallel jobs used to establish the PARAFAC models on sub-datasets. None means 1, and -1 means
+        using all processors.
+    warm_start: bool
+        Whether to initialize the PARAFAC models on sub-datasets with the ex/em loadings of the model established on
+        the complete dataset. This reduces the number of ALS iterations, but the sub-dataset models are no longer
+        independent of the complete model.
 
     Attributes
     -----------
@@ -2074,7 +2471,7 @@ class SplitValidation:
     """
 
     def __init__(self, rank, n_split=4, combination_size='half', rule='random', similarity_metric='TCC',
-                 non_negativity=True, tf_normalization=True):
+                 non_negativity=True, tf_normalization=True, init='svd', n_jobs=None, warm_start=False):
         # ---------------Parameters-------------------
         self.rank = rank
         self.n_split = n_split
@@ -2083,6 +2480,9 @@ class SplitValidation:
         self.similarity_metric = similarity_metric
         self.non_negativity = non_negativity
         self.tf_normalization = tf_normalization
+        self.init = init
+        self.n_jobs = n_jobs
+        self.warm_start = warm_start
 
         # ----------------Attributes------------------
         self.eem_subsets = None
@@ -2094,20 +2494,23 @@ class SplitValidation:
             cs = int(self.n_split) / 2
         else:
             cs = int(self.combination_size)
-        elements = list(itertools.combinations([i for i in range(self.n_split)], int(cs)))
-        codes = list(itertools.combinations(list(string.ascii_uppercase)[0:self.n_split], int(cs)))
-        model_complete = PARAFAC(rank=self.rank, non_negativity=self.non_negativity,
+        elements = list(itertools.combinations(range(self.n_split), int(cs)))
+        model_complete = PARAFAC(rank=self.rank, non_negativity=self.non_negativity, init=self.init,
                                  tf_normalization=self.tf_normalization)
         model_complete.fit(eem_dataset=eem_dataset)
         sims_ex, sims_em, models, subsets = ({}, {}, {}, {})
 
-        for e, c in zip(elements, codes):
-            label = ''.join(c)
-            subdataset = combine_eem_datasets([split_set[i] for i in e])
-            model_subdataset = PARAFAC(rank=self.rank, non_negativity=self.non_negativity,
-                                       tf_normalization=self.tf_normalization)
-            model_subdataset.fit(subdataset)
-
+        init_loadings = model_complete.cptensors[1][1:] if self.warm_start else None
+        # the sub-dataset models are independent of each other
+        fitted = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_parafac_on_subsets)([split_set[i] for i in e], rank=self.rank,
+                                             non_negativity=self.non_negativity,
+                                             tf_normalization=self.tf_normalization, init=self.init,
+                                             init_loadings=init_loadings)
+            for e in elements
+        )
+        for e, (model_subdataset, subdataset) in zip(elements, fitted):
+            label = ''.join(string.ascii_uppercase[i] for i in e)
             models[label] = model_subdataset
             subsets[label] = subdataset
         models = align_parafac_components(models, model_complete.ex_loadings, model_complete.em_loadings)
@@ -2127,25 +2530,20 @@ class SplitValidation:
             Similarities in emission loadings.
         """
         labels = sorted(self.subset_specific_models.keys())
-        similarities_ex = {}
-        similarities_em = {}
-        for k in range(int(len(labels) / 2)):
-            m1 = self.subset_specific_models[labels[k]]
-            m2 = self.subset_specific_models[labels[-1 - k]]
-            sims_ex = loadings_similarity(m1.ex_loadings, m2.ex_loadings).to_numpy().diagonal()
-            sims_em = loadings_similarity(m1.em_loadings, m2.em_loadings).to_numpy().diagonal()
-            pair_labels = '{m1} vs. {m2}'.format(m1=labels[k], m2=labels[-1 - k])
-            similarities_ex[pair_labels] = sims_ex
-            similarities_em[pair_labels] = sims_em
-        similarities_ex = pd.DataFrame.from_dict(
-            similarities_ex, orient='index',
-            columns=['Similarities in C{i}-ex'.format(i=i + 1) for i in range(self.rank)]
-        )
+        n_pairs = int(len(labels) / 2)
+        models1 = [self.subset_specific_models[labels[k]] for k in range(n_pairs)]
+        models2 = [self.subset_specific_models[labels[-1 - k]] for k in range(n_pairs)]
+        pair_labels = ['{m1} vs. {m2}'.format(m1=labels[k], m2=labels[-1 - k]) for k in range(n_pairs)]
+        # the similarities between matched components of all pairs are computed at once on stacked loadings
+        sims_ex = _matched_loadings_similarity(np.stack([m.ex_loadings.to_numpy(dtype=float) for m in models1]),
+                                               np.stack([m.ex_loadings.to_numpy(dtype=float) for m in models2]))
+        sims_em = _matched_loadings_similarity(np.stack([m.em_loadings.to_numpy(dtype=float) for m in models1]),
+                                               np.stack([m.em_loadings.to_numpy(dtype=float) for m in models2]))
+        similarities_ex = pd.DataFrame(sims_ex, index=pair_labels,
+                                       columns=['Similarities in C{i}-ex'.format(i=i + 1) for i in range(self.rank)])
         similarities_ex.index.name = 'Test'
-        similarities_em = pd.DataFrame.from_dict(
-            similarities_em, orient='index',
-            columns=['Similarities in C{i}-em'.format(i=i + 1) for i in range(self.rank)]
-        )
+        similarities_em = pd.DataFrame(sims_em, index=pair_labels,
+                                       columns=['Similarities in C{i}-em'.format(i=i + 1) for i in range(self.rank)])
         similarities_em.index.name = 'Test'
         return similarities_ex, similarities_em
 
@@ -2176,8 +2574,9 @@ class KPARAFACs:
         confirmed.
     non_negativity: bool
         Whether to apply the non-negativity constraint
-    init: str or tensorly.CPTensor, {‘svd’, ‘random’, CPTensor}
-        Type of factor matrix initialization
+    init: str or tensorly.CPTensor, {‘svd’, ‘randomized_svd’, ‘random’, CPTensor}
+        Type of factor matrix initialization. 'randomized_svd' initializes with a randomized truncated SVD, which is
+        cheaper than the full SVD when the rank is much smaller than the EEM dimensions.
     tf_normalization: bool
         Whether to normalize the EEMs by the total fluorescence in PARAFAC model establishment
     loadings_normalization: str or None, {'sd', 'maximum', None}
@@ -2275,11 +2674,15 @@ class KPARAFACs:
         def maximization(models: dict):
             sample_error = []
             sub_datasets = {}
+            # the reconstruction error is measured against the EEMs as fitted by eems_fit_components, i.e., with nan
+            # values set to 0
+            eem_stack_filled = np.where(np.isnan(eem_dataset.eem_stack), 0, eem_dataset.eem_stack)
             for label, m in models.items():
                 score_m, fmax_m, eem_stack_re_m = m.predict(eem_dataset)
-                res = m.eem_stack_train - eem_stack_re_m
-                n_pixels = m.eem_stack_train.shape[1] * m.eem_stack_train.shape[2]
-                rmse = sqrt(np.sum(res ** 2, axis=(1, 2)) / n_pixels)
+                res = eem_stack_filled - eem_stack_re_m
+                n_pixels = res.shape[1] * res.shape[2]
+                sse = np.einsum('ijk,ijk->i', res, res)
+                rmse = np.sqrt(sse / n_pixels, out=sse)
                 sample_error.append(rmse)
             best_model_idx = np.argmin(sample_error, axis=0)
             least_model_errors = np.min(sample_error, axis=0)
@@ -2472,9 +2875,9 @@ class KPARAFACs:
         best_model_label: pd.DataFrame
             The best-fit model for every EEM.
         score_all: pd.DataFrame
-            The score fitted with each cluster-specific model.
+            The score fitted with each cluster-specific model. The columns are grouped by the cluster labels.
         fmax_all: pd.DataFrame
-            The fmax fitted with each cluster-specific model.
+            The fmax fitted with each cluster-specific model. The columns are grouped by the cluster labels.
         sample_error: pd.DataFrame
             The RMSE fitted with each cluster-specific model.
         """
@@ -2482,27 +2885,30 @@ class KPARAFACs:
         sample_error = []
         score_all = []
         fmax_all = []
+        # the reconstruction error is measured against the EEMs as fitted by eems_fit_components, i.e., with nan values
+        # set to 0
+        eem_stack_filled = np.where(np.isnan(eem_dataset.eem_stack), 0, eem_dataset.eem_stack)
 
         for label, m in self.cluster_specific_models.items():
             score_m, fmax_m, eem_stack_re_m = m.predict(eem_dataset)
-            res = m.eem_stack_train - eem_stack_re_m
-            n_pixels = m.eem_stack_train.shape[1] * m.eem_stack_train.shape[2]
-            rmse = sqrt(np.sum(res ** 2, axis=(1, 2)) / n_pixels)
+            res = eem_stack_filled - eem_stack_re_m
+            n_pixels = res.shape[1] * res.shape[2]
+            sse = np.einsum('ijk,ijk->i', res, res)
+            rmse = np.sqrt(sse / n_pixels, out=sse)
             sample_error.append(rmse)
             score_all.append(score_m)
             fmax_all.append(fmax_m)
 
-        score_all = pd.DataFrame(np.array(score_all), index=eem_dataset.index,
-                                 columns=list(self.cluster_specific_models.keys()))
-        fmax_all = pd.DataFrame(np.array(fmax_all), index=eem_dataset.index,
-                                columns=list(self.cluster_specific_models.keys()))
+        # one group of columns per cluster-specific model
+        score_all = pd.concat(score_all, axis=1, keys=list(self.cluster_specific_models.keys()))
+        fmax_all = pd.concat(fmax_all, axis=1, keys=list(self.cluster_specific_models.keys()))
         best_model_idx = np.argmin(sample_error, axis=0)
         # least_model_errors = np.min(sample_error, axis=0)
         # score_opt = np.array([score_all[i, j] for j, i in enumerate(best_model_idx)])
         # fmax_opt = np.array([fmax_all[i, j] for j, i in enumerate(best_model_idx)])
         best_model_label = np.array([list(self.cluster_specific_models.keys())[idx] for idx in best_model_idx])
         best_model_label = pd.DataFrame(best_model_label, index=eem_dataset.index, columns=['best-fit model'])
-        sample_error = pd.DataFrame(np.array(sample_error), index=eem_dataset.index,
+        sample_error = pd.DataFrame(np.array(sample_error).T, index=eem_dataset.index,
                                     columns=list(self.cluster_specific_models.keys()))
 
         return best_model_label, score_all, fmax_all, sample_error
@@ -2615,18 +3021,14 @@ class EEMNMF:
         nnls_score = pd.DataFrame(nnls_score, index=eem_dataset.index,
                                   columns=["component {i} NNLS-score".format(i=i + 1) for i in range(self.n_components)])
         if sort_em:
-            em_peaks = []
-            for i in range(self.n_components):
-                flat_max_index = components[i].argmax()
-                row_index, col_index = np.unravel_index(flat_max_index, components[i].shape)
-                em_peaks.append(col_index)
-            peak_rank = list(enumerate(stats.rankdata(em_peaks)))
-            order = [i[0] for i in sorted(peak_rank, key=lambda x: x[1])]
+            _, em_peaks = np.unravel_index(components.reshape([self.n_components, -1]).argmax(axis=1),
+                                           components.shape[1:])
+            order = np.argsort(em_peaks, kind='stable')
             components = components[order]
-            nmf_score = pd.DataFrame({'component {r} NMF-score'.format(r=i + 1): nmf_score.iloc[:, order[i]]
-                                      for i in range(self.n_components)})
-            nnls_score = pd.DataFrame({'component {r} NNLS-score'.format(r=i + 1): nnls_score.iloc[:, order[i]]
-                                       for i in range(self.n_components)})
+            nmf_score = nmf_score.iloc[:, order]
+            nmf_score.columns = ['component {r} NMF-score'.format(r=i + 1) for i in range(self.n_components)]
+            nnls_score = nnls_score.iloc[:, order]
+            nnls_score.columns = ['component {r} NNLS-score'.format(r=i + 1) for i in range(self.n_components)]
         self.nmf_score = nmf_score
         self.nnls_score = nnls_score
         self.components = components
@@ -2660,6 +3062,9 @@ class EEMNMF:
                          criteria: str = 'reconstruction_error', true_values=None, axis=0, n_steps='max',
                          index_groups=None):
         eem_stack = eem_dataset_train.eem_stack
+        # the reconstruction error is measured against the test EEMs as fitted by eems_fit_components, i.e., with nan
+        # values set to 0
+        eem_stack_test = np.where(np.isnan(eem_dataset_test.eem_stack), 0, eem_dataset_test.eem_stack)
         if index_groups == None:
             index_groups = [[i] for i in range(eem_stack.shape[axis])]
         if n_steps == 'max':
@@ -2683,7 +3088,7 @@ class EEMNMF:
                 score, fmax, eem_stack_pred = eems_fit_components(eem_dataset_test.eem_stack, self.components,
                                                                   fit_intercept=False, positive=True)
                 if criteria == 'reconstruction_error':
-                    residual = eem_stack_pred - eem_dataset_test.eem_stack
+                    residual = eem_stack_pred - eem_stack_test
 
                 elif criteria == 'fmax_error':
                     assert true_values.shape == (eem_dataset_test.eem_stack.shape[0], self.n_components), \
@@ -2696,7 +3101,7 @@ class EEMNMF:
                         "True values should have a shape of (n_components, n_ex, n_em)"
                     residual = self.components - np.array(true_values)
 
-                error = (np.sum(residual ** 2) / np.size(residual)) ** 0.5
+                error = np.sqrt(np.vdot(residual, residual) / np.size(residual))
                 err_list.append(error)
                 fmax_list.append(fmax)
                 eem_dataset_sub_list.append(eem_dataset_sub)
@@ -2746,7 +3151,7 @@ class EEMNMF:
                     score, fmax, eem_stack_pred = eems_fit_components(eem_dataset_test.eem_stack, self.components,
                                                                       fit_intercept=False, positive=True)
                     if criteria == 'reconstruction_error':
-                        residual = eem_stack_pred - eem_dataset_test.eem_stack
+                        residual = eem_stack_pred - eem_stack_test
 
                     elif criteria == 'fmax_error':
                         assert true_values.shape == (eem_dataset_test.eem_stack.shape[0], self.n_components), \
@@ -2759,13 +3164,13 @@ class EEMNMF:
                             "True values should have a shape of (n_components, n_ex, n_em)"
                         residual = self.components - np.array(true_values)
 
-                    error = (np.sum(residual ** 2) / np.size(residual)) ** 0.5
+                    error = np.sqrt(np.vdot(residual, residual) / np.size(residual))
                     err_list.append(error)
                     fmax_list.append(fmax)
                     eem_dataset_sub_list.append(eem_dataset_sub)
 
-            least_err_idx = err_list.index(min(err_list))
-            err_sequence.append(min(err_list))
+            least_err_idx = int(np.argmin(err_list))
+            err_sequence.append(err_list[least_err_idx])
             fmax_sequence.append(pd.DataFrame(fmax_list[least_err_idx], index=eem_dataset_test.index,
                                               columns=["component {i}".format(i=i + 1) for i in
                                                        range(self.n_components)]))
@@ -469,14 +469,12 @@ def plot_loadings(parafac_models_dict: dict, colors=list(TABLEAU_COLORS.values()
 
 
 def plot_score(score_table, component_labels=None, display=True, yaxis_title='Score'):
-    # Create a scatter plot
-    fig = go.Figure()
-    for i in range(score_table.shape[1]):
-        fig.add_trace(go.Scatter(
-            x=score_table.index,
-            y=score_table[score_table.columns[i]],
-            name=score_table.columns[i] if component_labels is None else component_labels[i]
-        ))
+    # Create a scatter plot; all traces are passed at once so that the figure is validated only once
+    fig = go.Figure(data=[go.Scatter(
+        x=score_table.index,
+        y=score_table[score_table.columns[i]],
+        name=score_table.columns[i] if component_labels is None else component_labels[i]
+    ) for i in range(score_table.shape[1])])
 
     fig.update_xaxes(tickangle=90)
 
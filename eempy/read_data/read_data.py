@@ -7,14 +7,23 @@ Important information: The current version only supports reading Aqualog (HORIBA
 contact me by email if you have the need to read other types of EEM raw data.
 """
 
+import io
 import os
 import re
 import numpy as np
 import pandas as pd
 from datetime import datetime
+from functools import lru_cache
 from typing import Union, Tuple, List
 from eempy.eem_processing import eem_interpolation, process_eem_stack
 from scipy.interpolate import interp1d
+from joblib import Parallel, delayed
+
+_NUMERIC_LINE = re.compile(r"\s*[-+]?\.?\d")
+_PARAFAC_TABLE_ROW = re.compile(r"(Ex|Em|Score)\t")
+_PARAFAC_END = re.compile(r"#\s*end")
+_DEFAULT_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}")
+_INTEGER = re.compile(r"\d+")
 
 
 def read_eem(file_path: str, index_pos: Union[Tuple, List, None] = None, data_format: str = 'aqualog',
@@ -54,7 +63,7 @@ def read_eem(file_path: str, index_pos: Union[Tuple, List, None] = None, data_fo
     if index_pos:
         index = os.path.basename(file_path)[index_pos[0]-1:index_pos[1]]
         if as_timestamp:
-            index = datetime.strptime(index, timestamp_format)
+            index = str_to_datetime(index, timestamp_format)
     else:
         index = None
     with open(file_path, 'r') as of:
@@ -63,34 +72,24 @@ def read_eem(file_path: str, index_pos: Union[Tuple, List, None] = None, data_fo
             firstline = of.readline()
 
             # remove unwanted characters
-            firstline = re.findall(r"\d+", firstline)
+            firstline = _INTEGER.findall(firstline)
             header = np.array([list(map(int, firstline))])
 
-            # get index (the first column, in this case the Em wavelength) and the EEM
-            idx = []
-            data = np.zeros(np.shape(header))
-            line = of.readline()  # start reading from the second line
-            while line:
-                initial = (line.split())[0]
-                # check if items only contains digits
-                try:
-                    initial = float(initial)
-                    idx.append(initial)
-                    # get fluorescence intensity data from each line
-                    dataline = np.array([list(map(float, (line.split())[1:]))])
-                    try:
-                        data = np.concatenate([data, dataline])
-                    except ValueError:
-                        print('please check the consistancy of header and data dimensions:\n')
-                        print('number of columns suggested by your header: ', np.size(data), '\n')
-                        print('number of columns you have in your intensity data: ', np.size(dataline))
-                        break
-                except ValueError:
-                    pass
-                line = of.readline()
-            of.close()
-            idx = np.array(list(map(float, idx)))
-            data = data[1:, :]
+            # get index (the first column, in this case the Em wavelength) and the EEM. Lines not starting with a
+            # number (e.g., "nm" or "Normalized by 1.000") are dropped, and the rest is parsed in a single C-level pass.
+            body_start = of.tell()
+            lines = [line for line in of if _NUMERIC_LINE.match(line)]
+            try:
+                table = np.loadtxt(lines, dtype=float, ndmin=2)
+                consistent = table.shape[1] == header.shape[1] + 1
+            except ValueError:
+                consistent = False
+            if consistent:
+                idx, data = table[:, 0], table[:, 1:]
+            else:
+                # the number of columns in some lines does not match the header: parse line by line
+                of.seek(body_start)
+                idx, data = _read_aqualog_eem_lines(of, header)
 
         # Transpose the data matrix to set Xaxis-Em and Yaxis-Ex due to the fact
         # that the wavelength range of Em is larger, and it is visually better to
@@ -108,6 +107,34 @@ def read_eem(file_path: str, index_pos: Union[Tuple, List, None] = None, data_fo
     return intensity, ex_range, em_range, index
 
 
+def _read_aqualog_eem_lines(of, header):
+    # Line-by-line parser of the body of an aqualog EEM file. It keeps the lines read before the first line whose
+    # number of columns does not match the header.
+    idx = []
+    rows = []
+    line = of.readline()
+    while line:
+        parts = line.split()
+        # check if items only contains digits
+        try:
+            initial = float(parts[0])
+            # get fluorescence intensity data from each line
+            dataline = list(map(float, parts[1:]))
+            if len(dataline) != header.shape[1]:
+                print('please check the consistancy of header and data dimensions:\n')
+                print('number of columns suggested by your header: ', header.shape[1], '\n')
+                print('number of columns you have in your intensity data: ', len(dataline))
+                break
+            idx.append(initial)
+            rows.append(dataline)
+        except ValueError:
+            pass
+        line = of.readline()
+    idx = np.array(idx, dtype=float)
+    data = np.array(rows, dtype=float).reshape([-1, header.shape[1]])
+    return idx, data
+
+
 def read_eem_dataset(folder_path: str, mandatory_keywords=None, optional_keywords=None, data_format: str = 'aqualog',
                      index_pos: Union[Tuple, List, None] = None, as_timestamp=False, timestamp_format=None,
                      custom_filename_list: Union[Tuple, List, None] = None, wavelength_alignment=False,
@@ -236,20 +263,11 @@ def read_abs(file_path, index_pos: Union[Tuple, List, None] = None, data_format=
         index = None
     with open(file_path, 'r') as of:
         if data_format == 'aqualog':
-            line = of.readline()
-            idx = []
-            data = []
-            while line:
-                initial = float((line.split())[0])
-                idx.append(initial)
-                try:
-                    value = float((line.split())[1])
-                    data.append(value)
-                except IndexError:
-                    # if no absorbance at specific wavelength, set the value to nan
-                    data.append(np.nan)
-                line = of.readline()
-            of.close()
+            # if no absorbance at specific wavelength, the value is set to nan
+            table = pd.read_csv(of, sep=r'\s+', header=None, names=[0, 1], usecols=[0, 1], engine='c',
+                                float_precision='round_trip')
+            idx = table[0].to_numpy(dtype=float)
+            data = table[1].to_numpy(dtype=float)
             ex_range = np.flipud(idx)
             absorbance = np.flipud(data)
         else:
@@ -353,15 +371,12 @@ def read_reference_from_text(filepath):
     """
     reference_data = []
     with open(filepath, "r") as f:
-        line = f.readline()
-        header = line.split()[0]
-        while line:
-            try:
-                line = f.readline()
-                reference_data.append(float(line.split()[0]))
-            except IndexError:
-                pass
-        f.close()
+        header = f.readline().split()[0]
+        for line in f:
+            parts = line.split()
+            # skip empty lines
+            if parts:
+                reference_data.append(float(parts[0]))
     return reference_data, header
 
 
@@ -371,28 +386,17 @@ def get_filelist(folderpath, mandatory_keywords, optional_keywords):
     and any of the optional keywords.
 
     """
-    filelist = os.listdir(folderpath)
     if isinstance(mandatory_keywords, str):
         mandatory_keywords = [mandatory_keywords]
     if isinstance(optional_keywords, str):
         optional_keywords = [optional_keywords]
-    filelist_mandatory_filtered = []
-    filelist_all_filtered = []
-
-    if mandatory_keywords:
-        for f in filelist:
-            if all(kw in f for kw in mandatory_keywords):
-                filelist_mandatory_filtered.append(f)
-    else:
-        filelist_mandatory_filtered = filelist
-
-    if optional_keywords:
-        for f in filelist_mandatory_filtered:
-            if any(kw in f for kw in optional_keywords):
-                filelist_all_filtered.append(f)
-    else:
-        filelist_all_filtered = filelist_mandatory_filtered
-
+    # the directory entries are filtered lazily, in a single pass
+    with os.scandir(folderpath) as entries:
+        filelist_all_filtered = [
+            entry.name for entry in entries
+            if (not mandatory_keywords or all(kw in entry.name for kw in mandatory_keywords))
+            and (not optional_keywords or any(kw in entry.name for kw in optional_keywords))
+        ]
     return filelist_all_filtered
 
 
@@ -417,81 +421,67 @@ def read_parafac_model(filepath):
     info_dict: dict
         A dictionary containing the model information
     """
+    # the file is read once and each line is assigned to its section in a single pass. Each table is then parsed
+    # from the buffer.
     with open(filepath, 'r') as f:
-        line = f.readline().strip()
-        line_count = 0
-        while '#' in line:
-            if "Fluorescence" in line:
+        text = f.readlines()
+    info_dict = {}
+    sections = {'Ex': [], 'Em': [], 'Score': []}
+    section = 'header'
+    complete = False
+    for raw_line in text:
+        line = raw_line.strip()
+        if line.startswith('#'):
+            if 'Fluorescence' in line:
                 print("Reading fluorescence measurement info...")
-            line = f.readline().strip()
-            line_count += 1
-        info_dict = {}
-        while '#' not in line:
-            phrase = line.split(sep='\t')
-            if len(phrase) > 1:
-                info_dict[phrase[0]] = phrase[1]
-            else:
-                info_dict[phrase[0]] = ''
-            line = f.readline().strip()
-            line_count += 1
-        while '#' in line:
-            if "Excitation" in line:
+            elif 'Excitation' in line:
                 print("Reading Ex/Em loadings...")
-            line = f.readline().strip()
-            line_count_spectra_start = line_count
-            line_count += 1
-        while "Ex" in line:
-            line = f.readline().strip()
-            line_count += 1
-        line_count_ex = line_count
-        ex_df = pd.read_csv(filepath, sep="\t", header=None, index_col=[0, 1],
-                            skiprows=line_count_spectra_start + 1, nrows=line_count_ex - line_count_spectra_start - 1)
-        component_label = ['component {rank}'.format(rank=r + 1) for r in range(ex_df.shape[1])]
-        ex_df.columns = component_label
-        ex_df.index.names = ['type', 'wavelength']
-        while "Em" in line:
-            line = f.readline().strip()
-            line_count += 1
-        line_count_em = line_count
-        em_df = pd.read_csv(filepath, sep='\t', header=None, index_col=[0, 1],
-                            skiprows=line_count_ex, nrows=line_count_em - line_count_ex)
-        em_df.columns = component_label
-        em_df.index.names = ['type', 'wavelength']
-        score_df = None
-        while '#' in line:
-            if "Score" in line:
+            elif 'Score' in line:
                 print("Reading component scores...")
-            line = f.readline().strip()
-            line_count += 1
-        line_count_score = line_count
-        while 'Score' in line:
-            line = f.readline().strip()
-            line_count += 1
-        while '#' in line:
-            if 'end' in line:
-                line_count_end = line_count
-                score_df = pd.read_csv(filepath, sep="\t", header=None, index_col=[0, 1],
-                                       skiprows=line_count_score, nrows=line_count_end - line_count_score)
-                score_df.index = score_df.index.set_levels(
-                    [score_df.index.levels[0], pd.to_datetime(score_df.index.levels[1])])
-                score_df.columns = component_label
-                score_df.index.names = ['type', 'time']
-                print('Reading complete')
-                line = f.readline().strip()
-        f.close()
+            elif _PARAFAC_END.match(line):
+                complete = True
+            if section == 'info':
+                section = 'spectra'
+            continue
+        table_type = _PARAFAC_TABLE_ROW.match(line)
+        if table_type:
+            sections[table_type.group(1)].append(raw_line)
+        elif section in ('header', 'info') and line:
+            section = 'info'
+            phrase = line.split(sep='\t')
+            info_dict[phrase[0]] = phrase[1] if len(phrase) > 1 else ''
+
+    def parse_section(rows):
+        return pd.read_csv(io.StringIO(''.join(rows)), sep="\t", header=None, index_col=[0, 1])
+
+    ex_df = parse_section(sections['Ex'])
+    component_label = ['component {rank}'.format(rank=r + 1) for r in range(ex_df.shape[1])]
+    ex_df.columns = component_label
+    ex_df.index.names = ['type', 'wavelength']
+    em_df = parse_section(sections['Em'])
+    em_df.columns = component_label
+    em_df.index.names = ['type', 'wavelength']
+    score_df = None
+    if sections['Score'] and complete:
+        score_df = parse_section(sections['Score'])
+        score_df.index = score_df.index.set_levels(
+            [score_df.index.levels[0], pd.to_datetime(score_df.index.levels[1])])
+        score_df.columns = component_label
+        score_df.index.names = ['type', 'time']
+        print('Reading complete')
     return ex_df, em_df, score_df, info_dict
 
 
-def read_parafac_models(datdir, kw):
+def read_parafac_models(datdir, kw, n_jobs=None):
     """
     Search all PARAFAC models in a folder by keyword in filenames and import all of them into a dictionary using
-    read_parafac_model()
+    read_parafac_model(). The files are independent of each other and can be read in parallel: n_jobs is the number
+    of parallel jobs (None means 1, and -1 means using all processors).
     """
-    datlist = get_filelist(datdir, kw)
+    datlist = get_filelist(datdir, kw, None)
+    models = Parallel(n_jobs=n_jobs)(delayed(read_parafac_model)(datdir + '/' + f) for f in datlist)
     parafac_results = []
-    for f in datlist:
-        filepath = datdir + '/' + f
-        ex_df, em_df, score_df, info_dict = read_parafac_model(filepath)
+    for f, (ex_df, em_df, score_df, info_dict) in zip(datlist, models):
         info_dict['filename'] = f
         d = {'info': info_dict, 'ex': ex_df, 'em': em_df, 'score': score_df}
         parafac_results.append(d)
@@ -504,5 +494,11 @@ def read_parafac_models(datdir, kw):
 #     return ts
 
 
+@lru_cache(maxsize=4096)
 def str_to_datetime(ts_string, ts_format='%Y-%m-%d-%H-%M-%S'):
+    # datetime.strptime re-parses the format on every call. The default format is parsed directly, and the results are
+    # cached since the same timestamps are typically converted many times (e.g., for every file of a campaign).
+    if ts_format == '%Y-%m-%d-%H-%M-%S' and _DEFAULT_TIMESTAMP.fullmatch(ts_string):
+        return datetime(int(ts_string[0:4]), int(ts_string[5:7]), int(ts_string[8:10]), int(ts_string[11:13]),
+                        int(ts_string[14:16]), int(ts_string[17:19]))
     return datetime.strptime(ts_string, ts_format)
@@ -10,25 +10,17 @@ from datetime import datetime, timedelta
 
 
 def dichotomy_search(nums, target):
-    start = 0
-    end = len(nums) - 1
-    if target < min(nums):
-        return np.where(nums == min(nums))[0][0]
-    if target > max(nums):
-        return np.where(nums == max(nums))[0][0]
-    while start <= end:
-        mid = (start + end) // 2
-        fdiff = nums[mid] - target
-        bdiff = nums[mid - 1] - target
-        if fdiff * bdiff <= 0:
-            if abs(fdiff) < abs(bdiff):
-                return mid
-            if abs(bdiff) <= abs(fdiff):
-                return mid - 1
-        elif nums[mid] < target:
-            start = mid + 1
-        else:
-            end = mid - 1
+    """
+    Find the index of the element closest to the target in an array sorted in ascending order. Ties are resolved in
+    favour of the smaller element, and targets outside the range of the array are mapped to the first or last index.
+    An array of targets can be passed to search all of them at once.
+    """
+    nums = np.asarray(nums)
+    if nums.shape[0] == 1:
+        return np.zeros(np.shape(target), dtype=int) if np.ndim(target) else 0
+    idx = np.clip(np.searchsorted(nums, target), 1, nums.shape[0] - 1)
+    idx = idx - (np.abs(target - nums[idx - 1]) <= np.abs(nums[idx] - target))
+    return idx if np.ndim(target) else int(idx)
 
 
 def euclidean_dist_for_tuple(t1, t2):
@@ -39,9 +31,15 @@ def euclidean_dist_for_tuple(t1, t2):
 
 
 def matrix_dtype_to_uint8(m):
-    m_r = np.copy(m)
-    m_r[m_r < 0] = 0
-    m_scaled = np.interp(m_r, (0, m_r.max()), (0, 255))
+    """
+    Rescale a matrix to uint8, mapping 0 to 0 and the maximum to 255 (negative values are set to 0). If a stack of
+    matrices (3d) is passed, each matrix is rescaled by its own maximum in a single vectorized pass.
+    """
+    m_r = np.maximum(m, 0)
+    m_max = m_r.max(axis=(-2, -1), keepdims=True)
+    # same linear mapping as np.interp(m_r, (0, m_max), (0, 255)), which maps the maximum exactly to 255
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m_scaled = np.where(m_r >= m_max, 255., m_r * (255 / m_max))
     m_scaled = m_scaled.astype(np.uint8)
     return m_scaled
 
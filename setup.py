@@ -15,6 +15,7 @@ setup(
         "numpy",
         "scipy",
         "scikit-learn",
+        "joblib",
         "matplotlib",
         "pandas",
         "tlviz",
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+from eempy.eem_processing.eem_processing import EEMDataset, KPARAFACs, PARAFAC, _interpolate_masked_1d, \
+    align_parafac_components, eem_ife_correction, eem_rayleigh_scattering_removal, eem_regional_integration
+from eempy.utils import dichotomy_search
+
+
+def test_interpolate_masked_1d_keeps_valid_pixels_next_to_nan():
+    x = np.arange(5.)
+    intensity = np.array([[1., np.nan, 3., 0., 5.]])
+    mask = np.array([[1, 1, 1, 0, 1]])
+    _interpolate_masked_1d(intensity, mask, x, 'linear', axis=1)
+    # valid pixels keep their values even when a neighbour is nan (interp1d turned the pixels 0-2 into nan), and
+    # the masked pixel is interpolated from its nearest valid neighbours
+    np.testing.assert_array_equal(intensity, [[1., np.nan, 3., 4., 5.]])
+
+
+def test_interpolate_masked_1d_nan_neighbour_propagates_to_masked_pixel():
+    x = np.arange(5.)
+    intensity = np.array([[1., 2., np.nan, 0., 5.]])
+    mask = np.array([[1, 1, 1, 0, 1]])
+    _interpolate_masked_1d(intensity, mask, x, 'linear', axis=1)
+    np.testing.assert_array_equal(intensity, [[1., 2., np.nan, np.nan, 5.]])
+
+
+def test_rayleigh_nan_o1_with_1d_ex_o2_keeps_unmasked_pixels():
+    rng = np.random.default_rng(0)
+    ex_range = np.arange(200., 402., 2.)
+    em_range = np.arange(250., 802., 2.)
+    intensity = rng.random((ex_range.size, em_range.size)) + 1
+    intensity_masked, mask_o1, mask_o2 = eem_rayleigh_scattering_removal(
+        intensity, ex_range, em_range, interpolation_dimension_o2='1d-ex', interpolation_method_o1='nan',
+        interpolation_method_o2='linear')
+    assert np.isnan(intensity_masked[mask_o1 == 0]).all()
+    # pixels outside both scattering bands and above the 1st order scattering are never modified, including those
+    # next to the nan band of the 1st order scattering
+    untouched = (mask_o1 == 1) & (mask_o2 == 1) & (intensity_masked != 0)
+    np.testing.assert_array_equal(intensity_masked[untouched], intensity[untouched])
+    assert not np.isnan(intensity_masked[untouched]).any()
+
+
+def _two_component_stack(rng, ex_range, em_range, peaks_ex, peaks_em, n_samples):
+    ex_loadings = np.stack([np.exp(-0.5 * ((ex_range - p) / 8) ** 2) for p in peaks_ex], axis=1)
+    em_loadings = np.stack([np.exp(-0.5 * ((em_range - p) / 10) ** 2) for p in peaks_em], axis=1)
+    return np.einsum('ir,jr,kr->ijk', rng.random((n_samples, 2)) + 0.5, ex_loadings, em_loadings)
+
+
+def test_parafac_fit_on_stack_with_nan():
+    rng = np.random.default_rng(0)
+    ex_range, em_range = np.arange(250., 300., 5.), np.arange(300., 375., 5.)
+    eem_stack = _two_component_stack(rng, ex_range, em_range, [255, 285], [310, 350], 10)
+    model_ref = PARAFAC(rank=2, tf_normalization=False).fit(EEMDataset(eem_stack.copy(), ex_range, em_range))
+    eem_stack[:, 0, :3] = np.nan
+    model = PARAFAC(rank=2, tf_normalization=False).fit(EEMDataset(eem_stack, ex_range, em_range))
+    # the missing pixels are masked instead of turning all loadings into nan
+    np.testing.assert_allclose(model.ex_loadings.to_numpy(), model_ref.ex_loadings.to_numpy(), atol=0.01)
+    np.testing.assert_allclose(model.em_loadings.to_numpy(), model_ref.em_loadings.to_numpy(), atol=0.01)
+
+
+def test_kparafacs_errors_on_stack_with_nan():
+    rng = np.random.default_rng(0)
+    ex_range, em_range = np.arange(250., 300., 5.), np.arange(300., 375., 5.)
+    eem_stack_1 = _two_component_stack(rng, ex_range, em_range, [255, 285], [310, 350], 10)
+    eem_stack_2 = _two_component_stack(rng, ex_range, em_range, [270, 295], [330, 365], 10)
+    eem_stack = np.concatenate([eem_stack_1, eem_stack_2])
+    eem_stack[:, 0, :3] = np.nan
+    index = ['sample {i}'.format(i=i) for i in range(eem_stack.shape[0])]
+
+    kparafacs = KPARAFACs(rank=2, n_clusters=2, max_iter=1, tf_normalization=False)
+    kparafacs.cluster_specific_models = {
+        1: PARAFAC(rank=2, tf_normalization=False).fit(EEMDataset(eem_stack[:10].copy(), ex_range, em_range)),
+        2: PARAFAC(rank=2, tf_normalization=False).fit(EEMDataset(eem_stack[10:].copy(), ex_range, em_range)),
+    }
+    best_model_label, _, _, sample_error = kparafacs.predict(EEMDataset(eem_stack.copy(), ex_range, em_range,
+                                                                        index=index))
+    assert np.isfinite(sample_error.to_numpy()).all()
+    assert best_model_label['best-fit model'].tolist() == [1] * 10 + [2] * 10
+
+    _, _, error_history = kparafacs.base_clustering(EEMDataset(eem_stack.copy(), ex_range, em_range, index=index))
+    assert np.isfinite(error_history.to_numpy()).all()
+
+
+def test_ife_correction_nan_absorbance_only_affects_its_wavelength():
+    ex_range_abs = np.arange(200., 402., 2.)
+    absorbance = np.linspace(0.5, 0.01, ex_range_abs.shape[0])
+    ex_range_eem, em_range_eem = np.arange(200., 300., 2.), np.arange(250., 402., 2.)
+    intensity = np.ones((ex_range_eem.shape[0], em_range_eem.shape[0]))
+    expected = eem_ife_correction(intensity, ex_range_eem, em_range_eem, absorbance, ex_range_abs)
+    # nan at 214 nm, and at the second last node so that the last emission wavelength sits on its right neighbour
+    absorbance[[7, -2]] = np.nan
+    intensity_corrected = eem_ife_correction(intensity, ex_range_eem, em_range_eem, absorbance, ex_range_abs)
+    # rows are in descending excitation wavelengths
+    nan_rows = ex_range_eem[::-1][np.isnan(intensity_corrected).all(axis=1)]
+    nan_columns = em_range_eem[np.isnan(intensity_corrected).all(axis=0)]
+    np.testing.assert_array_equal(nan_rows, [214.])
+    np.testing.assert_array_equal(nan_columns, [398.])
+    valid = ~np.isnan(intensity_corrected)
+    np.testing.assert_allclose(intensity_corrected[valid], expected[valid])
+
+
+def test_dichotomy_search_nearest_index():
+    nums = np.array([5., 14., 22., 71., 74.])
+    # 10.04 is closer to 14 than to 5; the former loop returned 0 for targets between the first two elements
+    assert dichotomy_search(nums, 10.04) == 1
+    assert dichotomy_search(nums, 9.5) == 0
+    # ties go to the smaller element, and targets outside the array are clamped to its ends
+    assert dichotomy_search(nums, 18.) == 1
+    assert dichotomy_search(nums, -3.) == 0
+    assert dichotomy_search(nums, 100.) == 4
+    # the former loop returned -1 for two-element arrays
+    assert dichotomy_search(np.array([0., 10.]), 7.) == 1
+    np.testing.assert_array_equal(dichotomy_search(nums, np.array([10.04, 18., 72.])), [1, 1, 3])
+
+
+def test_regional_integration_uses_em_min():
+    ex_range, em_range = np.arange(250., 300., 5.), np.arange(300., 400., 5.)
+    # the intensity equals the emission wavelength, so the linear interpolation and the trapezoidal rule are exact
+    intensity = np.tile(em_range, (ex_range.shape[0], 1))
+    integration, _ = eem_regional_integration(intensity, ex_range, em_range, ex_min=262., ex_max=280., em_min=330.,
+                                              em_max=371.)
+    # the region starts at em_min (330 nm), not at ex_min (262 nm, clamped to the first emission wavelength)
+    np.testing.assert_allclose(integration, (280. - 262.) * (371. ** 2 - 330. ** 2) / 2)
+
+
+def test_parafac_maximum_loadings_normalization():
+    rng = np.random.default_rng(0)
+    ex_range, em_range = np.arange(250., 300., 5.), np.arange(300., 375., 5.)
+    eem_stack = _two_component_stack(rng, ex_range, em_range, [255, 285], [310, 350], 10)
+    model = PARAFAC(rank=2, loadings_normalization='maximum', tf_normalization=False).fit(
+        EEMDataset(eem_stack.copy(), ex_range, em_range))
+    # both loadings are scaled by their maximum (the emission loadings used to be divided by their minimum)
+    np.testing.assert_allclose(model.ex_loadings.to_numpy().max(axis=0), 1)
+    np.testing.assert_allclose(model.em_loadings.to_numpy().max(axis=0), 1)
+    np.testing.assert_allclose(model.eem_stack_reconstructed, eem_stack, rtol=1e-3, atol=1e-3)
+
+
+def test_align_parafac_components_optimal_matching():
+    rng = np.random.default_rng(0)
+    ex_range, em_range = np.arange(250., 300., 5.), np.arange(300., 350., 5.)
+    model = PARAFAC(rank=2, tf_normalization=False).fit(
+        EEMDataset(_two_component_stack(rng, ex_range, em_range, [255, 285], [310, 340], 10), ex_range, em_range))
+    # orthonormal vectors orthogonal to the constant vector (i.e., zero-mean), so that the similarities (Pearson
+    # correlations) between the loadings below are exactly their coefficients
+    basis = np.linalg.qr(np.column_stack([np.ones(10), rng.random((10, 3))]))[0][:, 1:]
+    loadings_ref = basis[:, :2]
+    # similarities to the references C1/C2: component 1: 0.6/0.55, component 2: 0.7/0. Greedy matching pairs
+    # component 1 with C1 (total similarity 0.6), while the optimal assignment pairs it with C2 (0.55 + 0.7 = 1.25)
+    loadings = basis @ np.array([[0.6, 0.7], [0.55, 0.], [np.sqrt(1 - 0.6 ** 2 - 0.55 ** 2), np.sqrt(1 - 0.7 ** 2)]])
+    model.ex_loadings = pd.DataFrame(loadings, index=ex_range, columns=['component 1', 'component 2'])
+    model.em_loadings = pd.DataFrame(loadings, index=em_range, columns=['component 1', 'component 2'])
+    ex_ref = pd.DataFrame(loadings_ref, index=ex_range, columns=['C1', 'C2'])
+    em_ref = pd.DataFrame(loadings_ref, index=em_range, columns=['C1', 'C2'])
+    aligned = align_parafac_components({'model': model}, ex_ref, em_ref)['model']
+    assert aligned.ex_loadings.columns.tolist() == ['C1', 'C2']
+    np.testing.assert_array_equal(aligned.ex_loadings['C1'], loadings[:, 1])
+    np.testing.assert_array_equal(aligned.ex_loadings['C2'], loadings[:, 0])